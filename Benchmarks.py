@@ -0,0 +1,528 @@
+#-------------------------------------------------------------------------------
+# Name: Benchmarks
+# Purpose: Measure the performance of the hashing, copying and parsing
+#   code used by PyBackup and friends.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import os, shutil, sys, tempfile, time
+import porting
+
+def make_tree(root, files, size, folders=10):
+    """ Create a synthetic tree of files filled with random data """
+    data = os.urandom(size)
+    pathnames = []
+    for i in range(files):
+        folder = porting.addpath(root, "folder{:03d}".format(i % folders))
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        pn = porting.addpath(folder, "file{:06d}.dat".format(i))
+        with open(pn, 'wb') as fh:
+            fh.write(data)
+        pathnames.append(pn)
+    return pathnames
+
+def report(name, seconds, nbytes=None, count=None, cpu=None):
+    """ Print one line of benchmark results """
+    line = "{:36} {:10.6f}s".format(name, seconds)
+    if cpu is not None:
+        line += " {:8.3f}s cpu".format(cpu)
+    if nbytes is not None and seconds > 0:
+        line += " {:10.1f} MB/s".format(nbytes / seconds / 1e6)
+    if count is not None and count > 1 and seconds > 0:
+        line += " {:12,.0f} /s".format(count / seconds)
+    print(line)
+
+def bench_hashing(root):
+    """ Compare hash_many using 1, 2, 4 and 8 workers """
+    from crc32 import hash_many
+    pathnames = make_tree(root, 200, 4 * 1024 * 1024)
+    nbytes = 200 * 4 * 1024 * 1024
+    for workers in [1, 2, 4, 8]:
+        start = time.time()
+        for pn, crc in hash_many(pathnames, workers):
+            pass
+        report("hash_many workers={}".format(workers), time.time() - start, nbytes)
+
+def make_file(pn, size):
+    """ Create one (possibly very large) file without holding it in memory """
+    chunk = os.urandom(min(size, 64 * 1024 * 1024))
+    with open(pn, 'wb') as fh:
+        remaining = size
+        while remaining > 0:
+            fh.write(chunk[:remaining])
+            remaining -= len(chunk)
+
+def bench_io(root):
+    """ Compare crc32 read strategies and block sizes for 1 KB, 1 MB and 4 GB files """
+    import crc32
+    for size, count in [(1024, 10000), (1024 * 1024, 500), (4 * 1024 * 1024 * 1024, 1)]:
+        pathnames = []
+        for i in range(count):
+            pathnames.append(porting.addpath(root, "{}.{}.dat".format(size, i)))
+            make_file(pathnames[-1], size)
+        for method in ['read', 'readinto', 'mmap']:
+            for blocksize in [64 * 1024, 1024 * 1024, 16 * 1024 * 1024]:
+                start = time.time()
+                for pn in pathnames:
+                    crc32.crc32(pn, method, blocksize)
+                report("{:,} bytes {} {}K".format(size, method, blocksize // 1024),
+                    time.time() - start, size * count, count)
+        for pn in pathnames:
+            os.remove(pn)
+
+def count_stats(function, *args):
+    """ Call a function, counting the os.stat and os.lstat calls it makes.
+        os.path.isfile, isdir, exists and getmtime all use os.stat.
+        DirEntry.stat() is not counted; it is one call per entry at most.
+    """
+    counts = [0]
+    saved = os.stat, os.lstat
+    def counted_stat(*args, **kwargs):
+        counts[0] += 1
+        return saved[0](*args, **kwargs)
+    def counted_lstat(*args, **kwargs):
+        counts[0] += 1
+        return saved[1](*args, **kwargs)
+    os.stat, os.lstat = counted_stat, counted_lstat
+    try:
+        start = time.time()
+        function(*args)
+        return time.time() - start, counts[0]
+    finally:
+        os.stat, os.lstat = saved
+
+def bench_walk(root):
+    """ Time PyBackup backup and verify walks over an unchanged 100k file tree """
+    import PyBackup
+    from Logging import logging
+    log = logging(porting.addpath(root, "walk.log.txt"))
+    source = porting.addpath(root, "source")
+    dest = porting.addpath(root, "dest")
+    make_tree(source, 100000, 100, folders=1000)
+    PyBackup.cache = None
+    PyBackup.main(log, source, dest)    # the first backup copies everything
+    for name, function, args in [
+        ("backup (unchanged)", PyBackup.main, (log, source, dest)),
+        ("verify -u (unchanged)", PyBackup.verify, (log, dest, True))]:
+        seconds, stats = count_stats(function, *args)
+        report("{} {:,} os.stat".format(name, stats), seconds, None, 100000)
+
+def bench_copy(root):
+    """ Compare FileCopy methods copying 4 files of 256 MB """
+    import shutil
+    import FileCopy
+    size = 256 * 1024 * 1024
+    sources = []
+    for i in range(4):
+        sources.append(porting.addpath(root, "source{}.dat".format(i)))
+        make_file(sources[-1], size)
+    copies = {
+        "shutil.copyfile": shutil.copyfile,
+        "stream": FileCopy.copy_with_crc,
+        "reflink": lambda src, dst: FileCopy.copy_kernel(src, dst, 'reflink'),
+        "copy_file_range": lambda src, dst: FileCopy.copy_kernel(src, dst, 'copy_file_range'),
+        "sendfile": lambda src, dst: FileCopy.copy_kernel(src, dst, 'sendfile'),
+        }
+    for name, copy in copies.items():
+        start, cpu = time.time(), time.process_time()
+        try:
+            for pn in sources:
+                copy(pn, pn + ".copy")
+        except Exception as e:
+            print("{:36} not supported here: {}".format(name, e))
+            continue
+        report(name, time.time() - start, size * len(sources), None,
+            time.process_time() - cpu)
+        for pn in sources:
+            os.remove(pn + ".copy")
+
+def fake_crcs(count):
+    """ Return a dictionary of made up crcs by filename """
+    return {"IMG_{:07d} some longer name.jpg".format(i): "%08X" % (i * 2654435761 & 0xFFFFFFFF)
+        for i in range(count)}
+
+def bench_crcfile(root):
+    """ Compare crc.csv and crc.bin parse times and sizes for 10, 1k and 100k entries """
+    import CrcFile
+    for count in [10, 1000, 100000]:
+        crcs = fake_crcs(count)
+        csv_pn = porting.addpath(root, CrcFile.csv_filename)
+        bin_pn = porting.addpath(root, CrcFile.bin_filename)
+        CrcFile.write_csv(csv_pn, crcs)
+        CrcFile.write_bin(bin_pn, crcs, {fn: (12345678, 1600000000000000000) for fn in crcs})
+        repeat = max(1, 100000 // count)
+        names = list(crcs)[::max(1, count // 100)]
+        for name, function in [
+            ("read_csv", lambda: CrcFile.read_csv(csv_pn)),
+            ("read_bin", lambda: CrcFile.read_bin(bin_pn)),
+            ("CrcBin.lookup", lambda: [CrcFile.CrcBin(bin_pn).lookup(fn) for fn in names[:1]])]:
+            start = time.time()
+            for i in range(repeat):
+                function()
+            report("{:,} entries {}".format(count, name), (time.time() - start) / repeat)
+        print("{:,} entries: crc.csv {:,} bytes, crc.bin {:,} bytes".format(
+            count, os.path.getsize(csv_pn), os.path.getsize(bin_pn)))
+
+def bench_csvparse(root):
+    """ Compare the regular expression crc.csv parser with CrcFile.read_csv """
+    import re
+    import CrcFile
+
+    def read_csv_regex(filename):
+        """ The original per line parser, kept here for comparison """
+        crcs = {}
+        with open(filename) as f:
+            for line in f:
+                m = re.match('([0-9A-F]{8}),"(.*?)"', line)
+                if m == None:
+                    m = re.match('([0-9A-F]{8}),(.*)', line)
+                crcs[m.group(2)] = m.group(1)
+        return crcs
+
+    for count in [1000, 1000000]:
+        pn = porting.addpath(root, CrcFile.csv_filename)
+        CrcFile.write_csv(pn, fake_crcs(count))
+        repeat = max(1, 100000 // count)
+        for name, function in [("regex", read_csv_regex), ("read_csv", CrcFile.read_csv)]:
+            start = time.time()
+            for i in range(repeat):
+                function(pn)
+            report("{:,} lines {}".format(count, name), (time.time() - start) / repeat, None, count)
+
+def bench_dupscan(root):
+    """ Compare hashing every file with the size-first scan of FindCRCs -d """
+    import contextlib, io
+    import FindCRCs
+    from crc32 import crc32
+    from CmdFile import CmdFile
+    from Logging import logging
+
+    # A photo archive: most sizes are unique, a few files are copies
+    photos = porting.addpath(root, "photos")
+    os.makedirs(photos)
+    pathnames = []
+    for i in range(500):
+        pathnames.append(porting.addpath(photos, "IMG_{:04d}.jpg".format(i)))
+        make_file(pathnames[-1], 2 * 1024 * 1024 + i * 4096)
+    for i in range(0, 500, 50):
+        pathnames.append(pathnames[i] + ".copy.jpg")
+        shutil.copyfile(pathnames[i], pathnames[-1])
+    nbytes = sum(os.path.getsize(pn) for pn in pathnames)
+
+    start = time.time()
+    for pn in pathnames:
+        crc32(pn)
+    report("hash every file", time.time() - start, nbytes)
+
+    FindCRCs.log = logging(porting.addpath(root, "FindCRCs.txt"))
+    FindCRCs.cmdfile = CmdFile(porting.addpath(root, "RemoveDuplicates.cmd"))
+    FindCRCs.bytes_hashed = 0
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        FindCRCs.ScanFolder(photos)
+        FindCRCs.ScanDuplicates()
+    report("FindCRCs -d -q", time.time() - start, nbytes)
+    print("{:,} of {:,} bytes read, {} duplicates".format(FindCRCs.bytes_hashed, nbytes,
+        FindCRCs.stats[FindCRCs.szDuplicates]))
+
+def bench_snapshot(root):
+    """ Compare the FindCRCs master json file with a CrcFile snapshot for 1M files """
+    import json
+    import CrcFile
+    from collections import deque
+    crcs = {crc: "/mnt/nas/Photos/{}/{:02d}/{}".format(2000 + i % 20, i % 12, fn)
+        for i, (fn, crc) in enumerate(fake_crcs(1000000).items())}
+    json_pn = porting.addpath(root, "FindCRCs.json")
+    snapshot_pn = porting.addpath(root, "FindCRCs.snapshot")
+
+    def write_json():
+        """ The original master json file, encoded twice """
+        with open(json_pn, 'w') as fh:
+            json.dump(json.dumps(crcs), fh)
+
+    def read_json():
+        with open(json_pn) as fh:
+            return json.loads(json.load(fh))
+
+    for name, function in [
+        ("json write", write_json),
+        ("json read", read_json),
+        ("snapshot write", lambda: CrcFile.write_snapshot(snapshot_pn,
+            ((crc, pn, 1000000) for crc, pn in crcs.items()))),
+        ("snapshot read", lambda: deque(CrcFile.iter_snapshot(snapshot_pn), 0))]:
+        start = time.time()
+        function()
+        report(name, time.time() - start, None, len(crcs))
+    print("json {:,} bytes, snapshot {:,} bytes".format(
+        os.path.getsize(json_pn), os.path.getsize(snapshot_pn)))
+
+def bench_merge(root):
+    """ Compare the memory used to find duplicate crcs among 1M files """
+    import tracemalloc
+    from ContentIndex import ContentIndex, SortedRuns
+    items = [("%08X" % (i * 2654435761 % 900007), "/mnt/nas/Photos/{}/{:02d}/IMG_{:07d}.jpg".format(
+        2000 + i % 20, i % 12, i), 1000000 + i * 2654435761 % 900007 % 1000) for i in range(1000000)]
+
+    def find_dict():
+        """ The original FindCrcs: a dictionary of every crc """
+        crcs = {}
+        duplicates = 0
+        for crc, pn, size in items:
+            if crc in crcs:
+                duplicates += 1
+            else:
+                crcs[crc] = pn
+        return duplicates
+
+    def find_index(index):
+        for crc, pn, size in items:
+            index.add(pn, crc, size)
+        duplicates = sum(len(group) - 1 for group in index.groups())
+        index.close()
+        return duplicates
+
+    for name, function in [
+        ("dict", find_dict),
+        ("ContentIndex", lambda: find_index(ContentIndex(porting.addpath(root, "index.db")))),
+        ("SortedRuns 16 MB", lambda: find_index(SortedRuns(16 * 1024 * 1024)))]:
+        start = time.time()
+        duplicates = function()
+        report(name, time.time() - start, None, len(items))
+        # Memory is measured separately, tracemalloc slows everything down.
+        # It only sees Python objects, not the sqlite page cache.
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print("    {:,} duplicates, {:,.1f} MB peak".format(duplicates, peak / 1e6))
+
+def bench_latency(root):
+    """ Compare tree walks when every listing and stat takes 1 ms, as on a network share """
+    import glob
+    import CrcFile, DirScan
+    for i in range(200):
+        folder = porting.addpath(root, "year{:02d}".format(i // 20), "event{:02d}".format(i % 20))
+        crcs = {}
+        for pn in make_tree(folder, 10, 100, folders=1):
+            crcs[os.path.basename(pn)] = "12345678"
+        CrcFile.write_csv(porting.addpath(folder, CrcFile.csv_filename), crcs)
+
+    def find_glob(crcs, folder):
+        """ The original FindCrcs walk """
+        for pn in glob.glob(glob.escape(folder)+'/*'):
+            rootp, fn = os.path.split(pn)
+            if fn == "crc.csv":
+                crcs.update(CrcFile.read_csv(pn))
+            elif os.path.isdir(pn):
+                find_glob(crcs, pn)
+        return crcs
+
+    def find_walk(workers):
+        crcs = {}
+        for folder, (files, folders) in DirScan.walk(root, workers):
+            if CrcFile.csv_filename in files:
+                crcs.update(CrcFile.read_csv(files[CrcFile.csv_filename].path))
+        return crcs
+
+    def slow(function):
+        def delayed(*args, **kwargs):
+            time.sleep(0.001)
+            return function(*args, **kwargs)
+        return delayed
+
+    saved = os.scandir, os.stat, os.lstat
+    os.scandir, os.stat, os.lstat = slow(os.scandir), slow(os.stat), slow(os.lstat)
+    try:
+        for name, function in [
+            ("glob walk", lambda: find_glob({}, root)),
+            ("DirScan.walk workers=1", lambda: find_walk(1)),
+            ("DirScan.walk workers=8", lambda: find_walk(8)),
+            ("DirScan.walk workers=32", lambda: find_walk(32))]:
+            start = time.time()
+            function()
+            report(name, time.time() - start, None, 200)
+    finally:
+        os.scandir, os.stat, os.lstat = saved
+
+def bench_compare(root):
+    """ Time CompareCRCs -a over two 1M file dictionaries that differ by 1% """
+    import CompareCRCs
+    from CmdFile import CmdFile
+    from Logging import logging
+    log = logging(porting.addpath(root, "CompareCRCs.txt"))
+    cmdfile = CmdFile(porting.addpath(root, "RemoveDuplicates.cmd"))
+    count = 1000000
+    sides = [CompareCRCs.Crcs(porting.addpath(root, side)) for side in ["one", "two"]]
+    start = time.time()
+    for side, crcs in enumerate(sides):
+        for i in range(count):
+            changed = side and i % 100 == 0
+            crcs.add(log, cmdfile, "%08X" % (i * 2654435761 + changed & 0xFFFFFFFF),
+                1000 + i % 5000, "{:02d}/IMG_{:07d}.jpg".format(i % 50, i))
+    report("load 2 x {:,} files".format(count), time.time() - start, None, 2 * count)
+    start = time.time()
+    CompareCRCs.compare_dictionaries(log, sides[0], sides[1], porting.addpath(root, "diff.jsonl"))
+    report("compare_dictionaries", time.time() - start, None, 2 * count)
+    print("    {}".format(", ".join("{:,} {}".format(n, name) for name, n in CompareCRCs.errors.items())))
+
+def make_jpeg(values, payload):
+    """ Return a JPEG with EXIF data, a real one when Pillow is installed """
+    import io, struct, ExifHeader
+    app1 = ExifHeader.exif_header + ExifHeader.build_tiff(values)
+    try:
+        from PIL import Image
+    except ImportError:
+        # Segments in the right order, but the scan data is only noise
+        return (b'\xFF\xD8\xFF\xE1' + struct.pack('>H', len(app1) + 2) + app1
+            + b'\xFF\xDA\x00\x02' + os.urandom(payload) + b'\xFF\xD9')
+    data = io.BytesIO()
+    Image.effect_noise((1024, 768), 64).convert('RGB').save(data, "jpeg", exif=app1)
+    return data.getvalue()
+
+def bench_exif(root):
+    """ Time reading EXIF dates from 10k JPEGs, Pillow vs the header reader """
+    import ExifHeader
+    count = 10000
+    data = make_jpeg({'DateTimeOriginal': '2020:08:19 12:34:56',
+        'ExifImageWidth': 1024, 'ExifImageHeight': 768}, 256 * 1024)
+    pathnames = []
+    for i in range(count):
+        pn = porting.addpath(root, "IMG_{:05d}.jpg".format(i))
+        with open(pn, 'wb') as fh:
+            fh.write(data)
+        pathnames.append(pn)
+    print("    {:,} files of {:,} bytes".format(count, len(data)))
+    try:
+        import EXIF_Dating
+        readers = [("Pillow _getexif", EXIF_Dating.pillow_exif)] if EXIF_Dating.Image else []
+    except ImportError:
+        readers = []
+    if not readers:
+        print("    Pillow is not installed, only the header reader is timed")
+    readers.append(("ExifHeader.read_exif", ExifHeader.read_exif))
+    for name, reader in readers:
+        start, cpu = time.time(), time.process_time()
+        dated = sum(reader(pn).get('DateTimeOriginal') is not None for pn in pathnames)
+        report(name, time.time() - start, None, count, time.process_time() - cpu)
+        if dated != count:
+            print("    ERROR: only {:,} files were dated".format(dated))
+
+def bench_setexif(root):
+    """ Time changing the EXIF date of 200 JPEGs, checking the picture is unchanged """
+    import ExifHeader
+    count = 200
+    values = {'DateTimeOriginal': '2020:08:19 12:34:56', 'ExifImageWidth': 1024, 'ExifImageHeight': 768}
+    data = make_jpeg(values, 4 * 1024 * 1024)
+    pathnames = []
+    for i in range(count):
+        pn = porting.addpath(root, "IMG_{:05d}.jpg".format(i))
+        with open(pn, 'wb') as fh:
+            fh.write(data)
+        pathnames.append(pn)
+    print("    {:,} files of {:,} bytes".format(count, len(data)))
+    picture = ExifHeader.image_data(pathnames[0])
+    tiff = ExifHeader.build_tiff(dict(values, DateTimeOriginal='1959:07:25 20:04:00'))
+
+    def reencode(pn):
+        im = Image.open(pn)
+        im.save(pn, "jpeg", exif=ExifHeader.exif_header + tiff)
+
+    try:
+        from PIL import Image
+        writers = [("Pillow open and save", reencode)]
+    except ImportError:
+        print("    Pillow is not installed, only write_exif is timed")
+        writers = []
+    writers.append(("ExifHeader.write_exif", lambda pn: ExifHeader.write_exif(pn, tiff)))
+    for name, writer in writers:
+        for pn in pathnames:
+            with open(pn, 'wb') as fh:
+                fh.write(data)
+        start, cpu = time.time(), time.process_time()
+        for pn in pathnames:
+            writer(pn)
+        report(name, time.time() - start, None, count, time.process_time() - cpu)
+        dated = sum(ExifHeader.read_exif(pn).get('DateTimeOriginal') == '1959:07:25 20:04:00'
+            for pn in pathnames)
+        same = sum(ExifHeader.image_data(pn) == picture for pn in pathnames)
+        print("    {:,} files redated, {:,} with identical image data".format(dated, same))
+
+def bench_filedates(root):
+    """ Time dating 1M synthetic filenames, building regexes per call vs compiled """
+    import re, EXIF_Dating
+    count = 1000000
+    formats = ["{:04d}{:02d}{:02d}_{:02d}{:02d}{:02d}.jpg", "IMG_{:04d}-{:02d}-{:02d}_{:02d}.jpg",
+        "{:04d} {:02d} {:02d} party {:02d}{:02d}.jpg", "{1:02d}{2:02d}{0:02d}{3:02d}{4:02d}a.jpg",
+        "DSC{3:02d}{4:02d}{5:02d}.jpg", "holiday {0} {3:02d}.png"]
+    names = [formats[i % len(formats)].format(1990 + i % 35, 1 + i % 12, 1 + i % 28,
+        i % 24, i % 60, i % 59) for i in range(count)]
+
+    def search_dates(fn):
+        """ The regular expressions built and searched one at a time, as before """
+        sep = "[\\-\\._~ ]*?"
+        yyyy = "(19[0-9][0-9]|20[0-9][0-9])"+sep
+        mm = dd = hr = min = sec = "([0-9][0-9])"+sep
+        m = re.search("^"+yyyy+mm+dd+hr+min+sec, fn)
+        if m is not None:
+            return list(m.groups())
+        m = re.search("^([A-Z])*?_"+yyyy+mm+dd, fn)
+        if m is not None:
+            return list(m.groups()[1:])
+        m = re.search("^"+yyyy+mm+dd, fn)
+        if m is not None:
+            return list(m.groups())
+        mm = dd = yy = hr = min = "([0-9][0-9])"
+        m = re.search("^"+mm+dd+yy+hr+min+"[a-f]*([-~(][0-9]*[)]*)*\\.", fn)
+        if m is not None:
+            return ["20"+m.group(3), m.group(1), m.group(2), m.group(4), m.group(5), "00"]
+        return None
+
+    results = []
+    for name, function in [("re.search per pattern", lambda: [search_dates(fn) for fn in names]),
+            ("GetFileDate", lambda: [EXIF_Dating.GetFileDate(fn) for fn in names]),
+            ("GetFileDates", lambda: EXIF_Dating.GetFileDates(names))]:
+        start, cpu = time.time(), time.process_time()
+        dates = function()
+        report(name, time.time() - start, None, count, time.process_time() - cpu)
+        results.append([None if date is None else tuple(date) for date in dates])
+    print("    {:,} dated, results {}".format(count - results[-1].count(None),
+        "match" if results[0] == results[1] == results[2] else "DIFFER"))
+
+benchmarks = {
+    "hashing": bench_hashing,
+    "io": bench_io,
+    "walk": bench_walk,
+    "copy": bench_copy,
+    "crcfile": bench_crcfile,
+    "csvparse": bench_csvparse,
+    "dupscan": bench_dupscan,
+    "snapshot": bench_snapshot,
+    "merge": bench_merge,
+    "latency": bench_latency,
+    "compare": bench_compare,
+    "exif": bench_exif,
+    "setexif": bench_setexif,
+    "filedates": bench_filedates,
+    }
+
+if __name__ == '__main__':
+    """ Benchmarks [names]
+        Run the named benchmarks, or all of them, in a temporary folder.
+    """
+    names = sys.argv[1:] or list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            print("Unknown benchmark: {} (try {})".format(name, ", ".join(benchmarks)))
+            continue
+        root = tempfile.mkdtemp(prefix="Benchmarks.")
+        try:
+            print("\n{}: {}".format(name, benchmarks[name].__doc__.strip()))
+            benchmarks[name](root)
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
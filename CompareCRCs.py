@@ -9,31 +9,37 @@
 # Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 #-------------------------------------------------------------------------------
 
-import glob, os, sys
+import json, os, sys
 
-from JsonFile import JsonFile
+import CrcFile, DirScan, porting
 from CmdFile import CmdFile
 from PyBackup import ReadCrcs
 from Logging import logging, display_update
 
 errors = {}
+workers = 1     # -j N: folders listed at the same time
 
 def help():
     print("""There are two ways to use this program.
 
-CompareCRCs <folder1> <folder2>
+CompareCRCs [-j N] <folder1> <folder2>
     Using this method folder1 and folder2 will be compared, one subfolder at a time.
     That works well for finding files that have the same name at each location,
     but different CRCs values.
+    Files moved or renamed in folder1 are found by their CRCs and sizes,
+    and moved within folder2 rather than copied again.
+    -j N lists N folders at the same time, which helps on network shares.
 e.g. CompareCRCs . %temp%\copy
 
-CompareCRCs -a [<folder1> | -r] [-w]  [<folder2> | -r] [-w]
+CompareCRCs -a [-j N] [<folder1> | -r] [-w]  [<folder2> | -r] [-w]
     Using this method a monolithic CRC dictionary is computed for each folder
     before being compared. This method will discover duplicate files within each
-    foldera nd report which CRC values exist only in one set or the other.
-    That makes it harder to notice files in both locations but with different CRC values.
+    folder and report which files (CRC and size) exist only in one set or the other,
+    and which files have the same name in both sets but different contents.
     The monolithic dictonaries can be read and written using -r and -w.
+    Pathnames read using -r are in the folder that was saved.
     When any of the command line switches are used, this method is selected.
+    Every difference is also written to CompareCRCs.jsonl, one JSON object per line.
 
 Examples:
     CompareCRCs -a c:\\users\\george\\pictures -w z:\\archive\\pictures
@@ -49,121 +55,261 @@ Examples:
     """)
     exit()
 
-def find_unique(log, crcs1, crcs2):
-    """ Find CRCs that are only in crcs1 """
-    global errors
-    for crc in crcs1:
-        if crc == "pathname":
-            continue
-        if crc not in crcs2:
-            log.error(errors, "unique crc", crcs1[crc])
-        else:
-            log.increment(errors, "identical crc")
+unknown = CrcFile.unknown_size
 
-def compare_dictionaries(log, crcs1, crcs2, cmdfile):
-    """ compare two dictionaries created from two folders """
-    global errors
-    for crcs in [crcs1, crcs2]:
-        crcs = FindCrcs(crcs, cmdfile, crcs["pathname"])
-    find_unique(log, crcs1, crcs2)
-    identical = "identical crc"
-    if identical in errors:
-        identical_crcs = errors[identical]
-    else:
-        identical = 0
-    find_unique(log, crcs2, crcs1)
-    errors[identical] = identical_crcs
+def content(crc, size):
+    """ Combine a crc and size into one integer, a cheap key for sets and dictionaries """
+    return int(crc, 16) << 64 | (unknown if size is None else size)
 
-def compare_folders(log, pn1, pn2, cmdfile):
-    """ Compare crc files in two folder """
+def crc_size(key):
+    """ Split a key made by content back into a crc and size """
+    size = key & unknown
+    return "%08X" % (key >> 64), None if size == unknown else size
+
+class Crcs:
+    """ The crc and size of every file in one tree, by name and by content.
+        Names are relative to the root of the tree.
+    """
+    def __init__(self, root=None):
+        self.root = root    # the absolute pathname of the tree
+        self.names = {}     # content by name
+        self.contents = {}  # the first name by content
+        self.loaded = False
+
+    def pathname(self, name):
+        return porting.addpath(self.root, name)
+
+    def add(self, log, cmdfile, crc, size, name):
+        """ Add one file, recording it when it duplicates an earlier one """
+        key = content(crc, size)
+        self.names[name] = key
+        original = self.contents.setdefault(key, name)
+        if original != name:
+            log.increment(errors, "duplicate file")
+            cmdfile.command(self.pathname(name), self.pathname(original), silent=True)
+
+    def load(self, log, cmdfile):
+        """ Read the crc files of every folder in the tree """
+        def visit(folder):
+            files, folders = DirScan.scan(folder)
+            crcs, lm = ReadCrcs(log, folder)
+            return (files, crcs), [entry.path for entry in folders]
+
+        for folder, (files, crcs) in DirScan.walk(self.root, workers, visit):
+            prefix = os.path.relpath(folder, self.root)
+            for fn, crc in crcs.items():
+                if fn not in files:
+                    log.increment(errors, "missing file")
+                    continue
+                name = fn if prefix == '.' else porting.addpath(prefix, fn)
+                self.add(log, cmdfile, crc, files[fn].size, name)
+        self.loaded = True
+
+    def read(self, log, cmdfile, filename):
+        """ Read a snapshot written by write, and the root it was saved from """
+        self.root = CrcFile.read_snapshot_root(filename)
+        if self.root is None:
+            log.error(errors, "snapshot has no root folder, recreate it with -w", filename)
+            exit()
+        for crc, name, size in CrcFile.iter_snapshot(filename):
+            self.add(log, cmdfile, crc, size, name)
+        self.loaded = True
+
+    def write(self, filename):
+        """ Write a snapshot of every file """
+        CrcFile.write_snapshot(filename, ((crc, name, size)
+            for name, (crc, size) in ((name, crc_size(key)) for name, key in self.names.items())),
+            self.root)
+
+def difference(diff, status, name, key1=None, key2=None, crcs1=None, crcs2=None):
+    """ Write one line of the machine readable difference file """
+    record = {"status": status, "name": name}
+    for side, key, crcs in [("1", key1, crcs1), ("2", key2, crcs2)]:
+        if key is not None:
+            record["crc" + side], record["size" + side] = crc_size(key)
+            record["pathname" + side] = crcs.pathname(name)
+    diff.write(json.dumps(record) + '\n')
+
+def compare_dictionaries(log, crcs1, crcs2, diff_filename):
+    """ compare two dictionaries created from two folders.
+        Every lookup is a hash, so this is one pass over each set of files.
+    """
     global errors
-    print('"{}": comparing, errors:{}'.format(log.nickname(pn1), log.sum(errors)))
-    display_update(0, "", True)
-    crcs1, lm1 = ReadCrcs(log, pn1)
-    crcs2, lm2 = ReadCrcs(log, pn2)
-
-    # look for differences and unique pn1 files
-    for fn, crc in crcs1.items():
-        srcfpn = pn1 + '\\' + fn
-        if fn in crcs2:
-            if crc != crcs2[fn]:
-                log.error(errors, "different file", srcfpn)
-                # copy src to dest? -- not real safe
+    with open(diff_filename, 'w') as diff:
+        for name, key in crcs1.names.items():
+            other = crcs2.names.get(name)
+            if key in crcs2.contents:
+                log.increment(errors, "identical crc")
             else:
-                log.increment(errors, "identical file")
-        else:
-            log.error(errors, "unique file", srcfpn, silent=True)
-            cmdfile.command(srcfpn, pn2)
+                log.error(errors, "unique crc", crcs1.pathname(name), silent=True)
+                difference(diff, "unique1", name, key, None, crcs1)
+            if other is not None and other != key:
+                log.error(errors, "different file", crcs1.pathname(name), silent=True)
+                difference(diff, "different", name, key, other, crcs1, crcs2)
+
+        for name, key in crcs2.names.items():
+            if key not in crcs1.contents:
+                log.error(errors, "unique crc", crcs2.pathname(name), silent=True)
+                difference(diff, "unique2", name, None, key, None, crcs2)
+
+def file_sizes(folder, names):
+    """ Return the size of each named file in a folder, or None if it cannot be stat'ed """
+    sizes = {}
+    for fn in names:
+        try:
+            sizes[fn] = os.stat(porting.addpath(folder, fn)).st_size
+        except OSError:
+            sizes[fn] = None
+    return sizes
 
-    # look for unique pn2 files
-    for fn in crcs2:
-        destfpn = pn2 + '\\' + fn
-        if fn not in crcs1:
-            srcpn = pn1 + '\\' + fn
-            log.error(errors, "unique file", destfpn, silent=True)
-            cmdfile.command(destfpn, pn1)
+def compare_folders(log, pn1, pn2, cmdfile):
+    """ Compare crc files in two folder trees.
+        Pairs of folders are read ahead by DirScan.walk, several at a time
+        with -j, but they are still compared in a depth first order.
+
+        Files that are only found on one side are matched by content
+        (crc and size) across both trees once the walk is done. A match
+        is a file that was moved or renamed, so rather than copying it
+        again, the command file moves the copy in folder2 to the same
+        place as in folder1. Folders found on only one side are walked
+        too, but only to find moves.
+    """
+    global errors, workers
+    BOTH, ONLY1, ONLY2 = 0, 1, 2
 
-    # Recursively look through subfolders in pn1
-    dirs1 = []
+    def visit(node):
+        """ Read both crc files, list both folders and size the unique files """
+        pn1, pn2, where = node
+        crcs1, lm1 = ReadCrcs(log, pn1) if where != ONLY2 else ({}, None)
+        crcs2, lm2 = ReadCrcs(log, pn2) if where != ONLY1 else ({}, None)
+        dirs1 = DirScan.subfolders(pn1) if where != ONLY2 else []
+        dirs2 = DirScan.subfolders(pn2) if where != ONLY1 else []
+        sizes1 = file_sizes(pn1, [fn for fn in crcs1 if fn not in crcs2])
+        sizes2 = file_sizes(pn2, [fn for fn in crcs2 if fn not in crcs1])
+        names1 = set(entry.name for entry in dirs1)
+        names2 = set(entry.name for entry in dirs2)
+        children = [(porting.addpath(pn1, fn), porting.addpath(pn2, fn),
+            BOTH if fn in names1 and fn in names2 else ONLY1 if fn in names1 else ONLY2)
+            for fn in sorted(names1 | names2)]
+        return (crcs1, crcs2, sizes1, sizes2, dirs1, dirs2), children
+
+    unique1 = []    # (content, pathname, folder it is missing from, where)
+    unique2 = {}    # [pathname, folder it is missing from, where] by content
     folders = 0
-    for pn in glob.glob(glob.escape(pn1)+'/*'):
-        rootp, fn = os.path.split(pn)
-        if os.path.isdir(pn):
-            folders += 1
-            display_update(folders, "folders")
-            if os.path.isdir(pn2+'\\'+fn):
-                # This handles folders found in both trees
-                dirs1 += [fn]
-                compare_folders(log, pn, pn2+'\\'+fn, cmdfile)
-            else:
-                log.error(errors, "unique folder", pn)
+    for (pn1, pn2, where), (crcs1, crcs2, sizes1, sizes2, dirs1, dirs2) in \
+        DirScan.walk((pn1, pn2, BOTH), workers, visit):
+        if where == BOTH:
+            print('"{}": comparing, errors:{}'.format(log.nickname(pn1), log.sum(errors)))
+        folders += 1
+        display_update(folders, "folders")
 
-    # look for unique subfolders in pn2, this need not be recursive
-    for pn in glob.glob(glob.escape(pn2)+'/*'):
-        if os.path.isdir(pn):
-            rootp, fn = os.path.split(pn)
-            if fn not in dirs1:
-                log.error(errors, "unique folder", pn)
+        # look for differences and unique pn1 files
+        for fn, crc in crcs1.items():
+            if fn in crcs2:
+                if crc != crcs2[fn]:
+                    log.error(errors, "different file", porting.addpath(pn1, fn))
+                    # copy src to dest? -- not real safe
+                else:
+                    log.increment(errors, "identical file")
+            elif sizes1[fn] is not None:
+                unique1.append((content(crc, sizes1[fn]), porting.addpath(pn1, fn), pn2, where))
+
+        # look for unique pn2 files
+        for fn, crc in crcs2.items():
+            if fn not in crcs1 and sizes2[fn] is not None:
+                unique2.setdefault(content(crc, sizes2[fn]), []).append(
+                    [porting.addpath(pn2, fn), pn1, where])
+
+        # Unique folders are reported here and walked only to find moves
+        if where == BOTH:
+            names1 = set(entry.name for entry in dirs1)
+            names2 = set(entry.name for entry in dirs2)
+            for entry in dirs1:
+                if entry.name not in names2:
+                    log.error(errors, "unique folder", entry.path)
+            for entry in dirs2:
+                if entry.name not in names1:
+                    log.error(errors, "unique folder", entry.path)
+
+    # Moves and renames, then files that really are only on one side
+    created = set()
+    for key, srcfpn, pn2, where in unique1:
+        matches = unique2.get(key)
+        if matches:
+            destfpn = matches.pop(0)[0]
+            if where == ONLY1 and pn2 not in created:
+                cmdfile.command(pn2, prefixes=["mkdir", ""])
+                created.add(pn2)
+            log.error(errors, "moved file", destfpn, silent=True)
+            cmdfile.command(destfpn, porting.addpath(pn2, os.path.basename(srcfpn)), prefixes=["move", ""])
+        elif where == BOTH:
+            log.error(errors, "unique file", srcfpn, silent=True)
+            cmdfile.command(srcfpn, pn2)
+    for matches in unique2.values():
+        for destfpn, pn1, where in matches:
+            if where == BOTH:
+                log.error(errors, "unique file", destfpn, silent=True)
+                cmdfile.command(destfpn, pn1)
 
 if __name__ == '__main__':
-    accumulate = False  # Until a switch is processed
     crcs = []
     display_update(0, "Reset")
 
     # (Re)Create the pathnames (and files) used by this programe
-    file1 = JsonFile("Compare.Crcs1.json")
-    file1crcs = None
-    file2 = JsonFile("Compare.Crcs2.json")
-    file2crcs = None
+    snapshots = [os.path.abspath("Compare.Crcs1.snapshot"), os.path.abspath("Compare.Crcs2.snapshot")]
     log = logging("CompareCRCs.txt")
 
-    if len(sys.argv) > 1:
-        for arg in sys.argv[1:]:
+    # CompareCRCs -j N ...
+    argv = sys.argv[:1]
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg[:2] in ['-j', '-J']:
+            try:
+                workers = int(arg[2:] or next(args, ''))
+            except ValueError:
+                help()
+        else:
+            argv.append(arg)
+
+    # Rebuild the command line
+    rootp, cmdline = os.path.split(sys.argv[0])
+    for arg in sys.argv[1:]:
+        cmdline += ' ' + arg
+
+    # Any other switch selects the dictionary method
+    accumulate = len(set(argv[1:]) & set(['-a', '-A', '-r', '-R', '/r', '/R', '-w', '-W', '/w', '/W'])) > 0
+    if accumulate:
+        cmdfile = CmdFile("RemoveDuplicates.cmd")
+        cmdfile.remark("{}".format(os.getcwd() + "> " + cmdline), silent=True)
+        cmdfile.remark("{} removes duplicate files.".format(cmdfile.log.logfile), silent=True)
+        cmdfile.remark("Pick which files to remove.", silent=True)
+    else:
+        cmdfile = CmdFile("AddReplacements.cmd", prefixes=["replace /a",""])
+        cmdfile.remark("{}".format(os.getcwd() + "> " + cmdline), silent=True)
+        cmdfile.remark("{} adds missing files using replace /a and moves files that were moved or renamed.".format(cmdfile.log.logfile), silent=True)
+
+    if len(argv) > 1:
+        for arg in argv[1:]:
             if arg in ['-?', '/?', '-h', '-H']:
                 help()
 
             elif arg in ['-a', '-A']:
-                accumulate = True
+                pass
 
             elif arg in ['-r', '-R', '/r', '/R']:
-                accumulate = True
-                if len(crcs) == 0:
-                    crcs += [{"pathname": pathname}]
-                    crcs[-1] += file1.read()
-                elif len(folders) == 1:
-                    crcs += [{"pathname": pathname}]
-                    crcs[-1] += file2.read()
-                else:
+                if len(crcs) >= 2:
                     help()
+                crcs += [Crcs()]
+                crcs[-1].read(log, cmdfile, snapshots[len(crcs)-1])
+                log.msg("Read {}".format(snapshots[len(crcs)-1]))
 
             elif arg in ['-w', '-W', '/w', '/W']:
-                accumulate = True
                 if len(crcs) == 0:
                     help()
-                elif len(crcs) == 1:
-                    file1.write(crcs[0])
-                else:
-                    file2.write(crcs[1])
+                if not crcs[-1].loaded:
+                    crcs[-1].load(log, cmdfile)
+                crcs[-1].write(snapshots[len(crcs)-1])
+                log.msg("Wrote {}".format(snapshots[len(crcs)-1]))
 
             else:
                 pathname = os.path.abspath(os.path.expandvars(arg))
@@ -171,31 +317,24 @@ if __name__ == '__main__':
                     log.error(errors, "does not exist", pathname)
                     help()
                 if len(crcs) < 2:
-                    crcs += [{"pathname": pathname}]
+                    crcs += [Crcs(pathname)]
                 else:
                     help()
 
     if len(crcs) < 2:
         help()
 
-    # Rebuild the command line
-    rootp, cmdline = os.path.split(sys.argv[0])
-    for arg in sys.argv[1:]:
-        cmdline += ' ' + arg
-
     if accumulate:
-        cmdfile = CmdFile("RemoveDuplicates.cmd")
-        cmdfile.remark("{}".format(os.getcwd() + "> " + cmdline), silent=True)
-        cmdfile.remark("{} removes duplicate files.".format(cmdfile.log.logfile), silent=True)
-        cmdfile.remark("Pick which files to remove.", silent=True)
-        compare_dictionaries(log, crcs[0], crcs[1], cmdfile)
+        for side in crcs:
+            if not side.loaded:
+                side.load(log, cmdfile)
+        diff_filename = logging("CompareCRCs.jsonl").logfile
+        compare_dictionaries(log, crcs[0], crcs[1], diff_filename)
         log.msg("\nCompareCRCs dictionaries complete.")
+        log.msg("Differences written to {}".format(diff_filename))
         log.counters(errors)
 
     else:
-        cmdfile = CmdFile("AddReplacements.cmd", prefixes=["replace /a",""])
-        cmdfile.remark("{}".format(os.getcwd() + "> " + cmdline), silent=True)
-        cmdfile.remark("{} adds missing files using replace /a.".format(cmdfile.log.logfile), silent=True)
-        compare_folders(log, crcs[0]["pathname"], crcs[1]["pathname"], cmdfile)
+        compare_folders(log, crcs[0].root, crcs[1].root, cmdfile)
         log.msg("\nCompareCRCs folder comparison complete.")
         log.counters(errors)
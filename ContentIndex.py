@@ -0,0 +1,227 @@
+#-------------------------------------------------------------------------------
+# Name: ContentIndex
+# Purpose: Index files by size and CRC32 on disk, and confirm which
+#   files are really identical before calling them duplicates.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import hashlib, heapq, os, shutil, sqlite3, tempfile
+
+def strong_hash(pn):
+    """ Return a cryptographic hash of a file, used to confirm CRC matches """
+    h = hashlib.blake2b()
+    with open(pn, 'rb') as fh:
+        while True:
+            rdata = fh.read(1024 * 1024)
+            if not rdata:
+                break
+            h.update(rdata)
+    return h.hexdigest()
+
+class FileIndex:
+    """ The interface shared by ContentIndex and SortedRuns.
+        CRC32 collisions become likely after tens of thousands of files,
+        so files sharing a size and crc are only candidates. confirm()
+        compares strong hashes, computed only for those candidates.
+        Subclasses provide add, groups, items and close.
+    """
+    def __init__(self):
+        self.count = 0  # files added
+
+    def __len__(self):
+        return self.count
+
+    def confirm(self, group):
+        """ Split a group of candidates into lists of truly identical files.
+            Files that cannot be read are left out.
+            Returns only the lists that contain duplicates.
+        """
+        identical = {}
+        for pn in group:
+            try:
+                identical.setdefault(strong_hash(pn), []).append(pn)
+            except OSError:
+                pass
+        return [files for files in identical.values() if len(files) > 1]
+
+class ContentIndex(FileIndex):
+    """ Provides an index of files by (size, crc) kept in a sqlite database. """
+    dbPathname = None
+    db = None
+    indexed = False
+
+    def __init__(self, filename=None):
+        """ filename can be a fully qualified pathname or simple filename.
+            By default a temporary file is used and removed by close().
+            Any pre-existing index is always removed.
+        """
+        super().__init__()
+        if filename is None:
+            fd, filename = tempfile.mkstemp(prefix="ContentIndex.", suffix=".db")
+            os.close(fd)
+        self.dbPathname = os.path.abspath(filename)
+        self.remove()
+        self.db = sqlite3.connect(self.dbPathname)
+        self.db.execute("PRAGMA journal_mode=OFF")
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, size INTEGER, crc INTEGER, pn TEXT)")
+
+    def add(self, pn, crc, size):
+        """ Add one file with its crc (a hexadecimal string) and size """
+        self.db.execute("INSERT INTO files (size, crc, pn) VALUES (?, ?, ?)",
+            (size, int(crc, 16), pn))
+        self.count += 1
+
+    def groups(self):
+        """ Yield lists of pathnames sharing a size and crc, in the order added """
+        if not self.indexed:
+            # Building the index once after loading is much faster than
+            # keeping it up to date while adding millions of rows.
+            self.db.execute("CREATE INDEX content ON files (size, crc, id)")
+            self.indexed = True
+        candidates = self.db.execute("SELECT size, crc FROM files "
+            "GROUP BY size, crc HAVING COUNT(*) > 1 ORDER BY MIN(id)")
+        for size, crc in candidates:
+            yield [row[0] for row in self.db.execute(
+                "SELECT pn FROM files WHERE size=? AND crc=? ORDER BY id", (size, crc))]
+
+    def items(self):
+        """ Yield (crc, pathname, size) for every file, in the order added """
+        for crc, pn, size in self.db.execute("SELECT crc, pn, size FROM files ORDER BY id"):
+            yield "%08X" % crc, pn, size
+
+    def close(self):
+        """ Close and remove the index """
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+        self.remove()
+
+    def remove(self):
+        try:
+            os.remove(self.dbPathname)
+        except:
+            pass # it is not noteworthy that a file to be deleted did not exist
+
+class SortedRuns(FileIndex):
+    """ Provides the same index using an external sort with bounded memory.
+        Files are collected in memory until limit bytes are used, then
+        sorted and spilled to a temporary run file. groups() merges the
+        runs, so memory stays the same however many files are added.
+        Pathnames containing a newline cannot be stored and are skipped.
+    """
+    max_runs = 64   # runs merged at once, and the most open files
+
+    def __init__(self, limit=64 * 1024 * 1024):
+        super().__init__()
+        self.limit = limit
+        self.folder = tempfile.mkdtemp(prefix="SortedRuns.")
+        self.runs = []
+        self.lines = []
+        self.buffered = 0
+        self.skipped = 0
+
+    def add(self, pn, crc, size):
+        """ Add one file with its crc (a hexadecimal string) and size """
+        if '\n' in pn:
+            self.skipped += 1
+            return
+        # Fixed width fields sort the lines by size, crc and order added
+        line = "{:020d}{:0>8}{:012d}{}\n".format(size, crc, self.count, pn)
+        self.lines.append(line)
+        self.count += 1
+        self.buffered += len(line) + 80    # the string, and its slot in the list
+        if self.buffered >= self.limit:
+            self.spill()
+
+    def spill(self):
+        """ Sort the lines in memory and write them to a new run """
+        if self.lines:
+            self.lines.sort()
+            self.runs.append(self.write_run(self.lines))
+            self.lines = []
+            self.buffered = 0
+        if len(self.runs) >= self.max_runs:
+            self.runs = [self.write_run(self.merge())]
+
+    def write_run(self, lines):
+        fd, pn = tempfile.mkstemp(dir=self.folder, suffix=".run")
+        with open(fd, 'w', encoding='utf-8', errors='surrogateescape', newline='\n') as f:
+            f.writelines(lines)
+        return pn
+
+    def merge(self, remove=True):
+        """ Yield the lines of every run in order, removing the runs once read """
+        files = [open(pn, encoding='utf-8', errors='surrogateescape', newline='\n')
+            for pn in self.runs]
+        try:
+            yield from heapq.merge(*files)
+        finally:
+            for f in files:
+                f.close()
+                if remove:
+                    os.remove(f.name)
+
+    def groups(self):
+        """ Yield lists of pathnames sharing a size and crc, in the order added.
+            This empties the index.
+        """
+        self.spill()
+        key = None
+        group = []
+        for line in self.merge():
+            if line[:28] != key:
+                if len(group) > 1:
+                    yield group
+                key = line[:28]
+                group = []
+            group.append(line[40:-1])
+        if len(group) > 1:
+            yield group
+
+    def items(self):
+        """ Yield (crc, pathname, size) for every file, sorted by size """
+        self.spill()
+        for line in self.merge(remove=False):
+            yield line[20:28], line[40:-1], int(line[:20])
+
+    def close(self):
+        """ Remove any runs left on disk """
+        self.lines = []
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+if __name__ == '__main__':
+    """ Test this class """
+    folder = tempfile.mkdtemp(prefix="ContentIndex.")
+    index = ContentIndex()
+    for fn, data in [("a", b"same"), ("b", b"same"), ("c", b"diff")]:
+        pn = os.path.join(folder, fn)
+        with open(pn, 'wb') as fh:
+            fh.write(data)
+        # Pretend every file has the same crc, as a collision would
+        index.add(pn, "12345678", 4)
+    for group in index.groups():
+        print("candidates: {}".format(group))
+        for files in index.confirm(group):
+            print("{}: confirmed duplicates {}".format(
+                "OK" if len(files) == 2 and files[0].endswith("a") else "ERROR", files))
+    index.close()
+
+    index = SortedRuns(limit=200)   # only a couple of files fit in memory
+    for i in range(20):
+        index.add(os.path.join(folder, "abc"[i % 3]), "12345678", 4)
+    groups = list(index.groups())
+    print("{}: {} files merged into {} groups".format(
+        "OK" if len(groups) == 1 and groups[0][0].endswith("a") and len(groups[0]) == 20
+        else "ERROR", index.count, len(groups)))
+    for files in index.confirm(groups[0]):
+        print("confirmed {} duplicates of {}".format(len(files) - 1, files[0]))
+    index.close()
+    for fn in ["a", "b", "c"]:
+        os.remove(os.path.join(folder, fn))
+    os.rmdir(folder)
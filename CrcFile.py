@@ -0,0 +1,424 @@
+#-------------------------------------------------------------------------------
+# Name: CrcFile
+# Purpose: Read and write the crc control files found in every folder.
+#
+#   crc.csv is the original text format: 8 hexadecimal characters,
+#   a comma and a quoted filename on every line.
+#   Changes may be appended to the end of a crc.csv, a later line for
+#   a filename replaces an earlier one and a crc of "--------" means
+#   the file was removed. Such a journal is compacted now and then.
+#   Readers older than the journal take a removed file for a file
+#   named after the tombstone, so they should only be given a crc.csv
+#   that has been compacted (see write_csv).
+#
+#   crc.bin is a compact binary format that can be searched by name
+#   using mmap, without reading the whole file:
+#       header  "PYCRC", version, 2 reserved bytes, uint32 count
+#       index   count uint32 offsets of the records, sorted by name
+#       records uint32 crc, uint64 size, int64 mtime_ns,
+#               uint16 name length, utf-8 name
+#   All numbers are little endian.
+#
+#   A snapshot holds the crcs of a whole tree, as saved by FindCRCs -w.
+#   Pathnames are sorted and grouped by folder. Each folder is stored
+#   once, as the part of its pathname that differs from the folder
+#   before it, followed by all of its files:
+#       header  "PYSNAP", version, reserved byte
+#       root    uint32 length, the folder pathnames are relative to (utf-8)
+#       folders uint32 file count, uint16 shared prefix length,
+#               uint16 folder length, uint32 names length,
+#               the rest of the folder pathname (utf-8),
+#               count uint32 crcs (big endian, so hex() prints them),
+#               count uint64 sizes (all ones when not known),
+#               the filenames (utf-8) separated by zero bytes
+#   A folder with a file count of zero ends the file.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import mmap, os, re, struct, sys
+from array import array
+import porting
+
+csv_filename = "crc.csv"
+bin_filename = "crc.bin"
+
+magic = b"PYCRC"
+version = 1
+header = struct.Struct("<5sBxxI")
+offset = struct.Struct("<I")
+record = struct.Struct("<IQqH")
+
+def encode(fn):
+    """ Filenames are stored as utf-8, keeping undecodable bytes intact """
+    return fn.encode('utf-8', 'surrogateescape')
+
+def decode(name):
+    return name.decode('utf-8', 'surrogateescape')
+
+snapshot_magic = b"PYSNAP"
+snapshot_header = struct.Struct("<6sBx")
+snapshot_folder = struct.Struct("<IHHI")
+snapshot_root = struct.Struct("<I")
+snapshot_version = 3
+unknown_size = 0xFFFFFFFFFFFFFFFF
+
+tombstone = "--------"   # the crc appended for a file that was removed
+valid_crcs = re.compile("(?:[0-9A-F]{8}|-{8})*")
+
+def parse_csv(filename):
+    """ Return parallel lists of crcs and filenames from a crc.csv file.
+        Raises an exception if the file is corrupted.
+
+        Every line in a CRC file is 8 hexadecimal characters, a comma
+        and the filename. The filename may be quoted.
+        The whole file is read at once and split at fixed offsets;
+        every crc is then validated with one regular expression.
+    """
+    with open(filename) as f:
+        lines = f.read().split('\n')
+    if lines[-1] == '':
+        lines.pop()
+    elif not complete(lines[-1]):
+        lines.pop()     # an append that was cut short
+
+    crcs = [line[:8] for line in lines]
+    if [line[8:9] for line in lines].count(',') != len(lines) \
+        or len(crcs) * 8 != sum(map(len, crcs)) \
+        or not valid_crcs.fullmatch("".join(crcs)):
+        raise Exception("{} is not a valid crc file".format(filename))
+
+    # A quoted name ends at the next quote, if there is one
+    parts = [line[10:].partition('"') if line[9:10] == '"' else None for line in lines]
+    names = [line[9:] if part is None or not part[1] else part[0] \
+        for line, part in zip(lines, parts)]
+    return crcs, names
+
+def complete(line):
+    """ Return True if a line written without a newline is still complete.
+        A quoted name must end with its quote. An unquoted name cannot be
+        checked, so it is kept whenever its crc is valid.
+    """
+    if len(line) < 10 or line[8] != ',' or not valid_crcs.fullmatch(line[:8]):
+        return False
+    return line[9] != '"' or line.find('"', 10) > 0
+
+def iter_csv(filename):
+    """ Yield (crc, filename) for every file in a crc.csv file.
+        Raises an exception if the file is corrupted.
+    """
+    return ((crc, fn) for fn, crc in read_csv(filename).items())
+
+def read_csv(filename):
+    """ Return a dictionary of crcs by filename from a crc.csv file.
+        Raises an exception if the file is corrupted.
+    """
+    crcs, names = parse_csv(filename)
+    journal = tombstone in crcs
+    crcs = dict(zip(names, crcs))
+    if journal:
+        for fn in [fn for fn, crc in crcs.items() if crc == tombstone]:
+            crcs.pop(fn)
+    return crcs
+
+def csv_line(crc, fn):
+    # Quote the pathname to make it work better in Excel
+    return crc+',"'+fn+'"\n'
+
+def write_csv(filename, crcs):
+    """ Write a dictionary of crcs by filename to a crc.csv file.
+        The file is written to a temporary file and then renamed.
+    """
+    temp = filename + ".tmp"
+    with open(temp, 'w') as f:
+        f.write("".join(csv_line(crcs[fn], fn) for fn in sorted(crcs)))
+    os.replace(temp, filename)
+
+def update_csv(filename, crcs, original):
+    """ Bring a crc.csv file up to date with as little writing as possible.
+        original is the dictionary that was read from the file.
+        Returns "unchanged", "appended" or "written".
+
+        When nothing changed nothing is written. A few changes are
+        appended in one write. The whole file is rewritten (compacted)
+        when the appended lines would make it twice its compact size.
+    """
+    if crcs == original:
+        return "unchanged"
+
+    changes = [csv_line(crc, fn) for fn, crc in crcs.items() if original.get(fn) != crc]
+    changes += [csv_line(tombstone, fn) for fn in original if fn not in crcs]
+    appended = "".join(changes)
+    compact = sum(len(encode(fn)) + 12 for fn in crcs)
+    try:
+        with open(filename, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(size - 1, 0))
+            ends_a_line = size == 0 or f.read(1) == b'\n'
+    except OSError:
+        size, ends_a_line = None, False
+
+    if size is None or not ends_a_line \
+        or size + len(encode(appended)) > 2 * compact + 4096:
+        write_csv(filename, crcs)
+        return "written"
+
+    with open(filename, 'a') as f:
+        f.write(appended)
+    return "appended"
+
+def write_bin(filename, crcs, stats=None):
+    """ Write a dictionary of crcs by filename to a crc.bin file.
+        stats is an optional dictionary of (size, mtime_ns) by filename.
+        The file is written to a temporary file and then renamed.
+    """
+    names = sorted((encode(fn), fn) for fn in crcs)
+    offsets = []
+    records = []
+    position = header.size + offset.size * len(names)
+    for name, fn in names:
+        size, mtime_ns = stats.get(fn, (0, 0)) if stats else (0, 0)
+        records.append(record.pack(int(crcs[fn], 16), size, mtime_ns, len(name)) + name)
+        offsets.append(offset.pack(position))
+        position += len(records[-1])
+
+    temp = filename + ".tmp"
+    with open(temp, 'wb') as f:
+        f.write(header.pack(magic, version, len(names)))
+        f.write(b"".join(offsets))
+        f.write(b"".join(records))
+    os.replace(temp, filename)
+
+class CrcBin:
+    """ Provides lookups by name in a crc.bin file using mmap. """
+    mm = None
+    count = 0
+
+    def __init__(self, filename):
+        """ Open a crc.bin file, raising an exception if it is not valid """
+        with open(filename, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        tag, ver, self.count = header.unpack_from(self.mm, 0)
+        if tag != magic or ver != version \
+            or header.size + offset.size * self.count > len(self.mm):
+            self.close()
+            raise Exception("{} is not a valid crc file".format(filename))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.count
+
+    def _record(self, i):
+        """ Return the name and values of record i, in name order """
+        position, = offset.unpack_from(self.mm, header.size + offset.size * i)
+        crc, size, mtime_ns, length = record.unpack_from(self.mm, position)
+        start = position + record.size
+        return self.mm[start:start+length], crc, size, mtime_ns
+
+    def lookup(self, fn):
+        """ Return (crc, size, mtime_ns) for a filename, or None.
+            This is a binary search that only touches a few pages.
+        """
+        name = encode(fn)
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found, crc, size, mtime_ns = self._record(middle)
+            if found < name:
+                low = middle + 1
+            elif found > name:
+                high = middle
+            else:
+                return "%08X" % crc, size, mtime_ns
+        return None
+
+    def items(self):
+        """ Yield (filename, crc, size, mtime_ns) for every record, in name order """
+        for i in range(self.count):
+            name, crc, size, mtime_ns = self._record(i)
+            yield decode(name), "%08X" % crc, size, mtime_ns
+
+    def crcs(self):
+        """ Return a dictionary of crcs by filename """
+        return {fn: crc for fn, crc, size, mtime_ns in self.items()}
+
+    def close(self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+
+def read_bin(filename):
+    """ Return a dictionary of crcs by filename from a crc.bin file """
+    with CrcBin(filename) as cb:
+        return cb.crcs()
+
+def read_crcs(filename):
+    """ Return a dictionary of crcs by filename from either kind of crc file,
+        chosen by its name (crc.bin or crc.csv).
+        Raises an exception if the file is corrupted.
+    """
+    if os.path.basename(filename) == bin_filename:
+        return read_bin(filename)
+    return read_csv(filename)
+
+def iter_crcs(filename):
+    """ Yield (crc, filename) for every file in either kind of crc file """
+    return ((crc, fn) for fn, crc in read_crcs(filename).items())
+
+def file_stats(folder, crcs):
+    """ Return a dictionary of (size, mtime_ns) for the files that exist """
+    stats = {}
+    for fn in crcs:
+        try:
+            st = os.stat(porting.addpath(folder, fn))
+            stats[fn] = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            pass
+    return stats
+
+def shared_prefix(previous, name):
+    """ Return the length of the prefix two names share (up to 65535).
+        A binary search compares slices, rather than one byte at a time.
+    """
+    low, high = 0, min(len(previous), len(name), 0xFFFF)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if previous[:middle] == name[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def split_folder(pn):
+    """ Split a pathname after its last separator, Windows or Linux """
+    i = max(pn.rfind('/'), pn.rfind(os.sep)) + 1
+    return pn[:i], pn[i:]
+
+def write_snapshot(filename, items, root=None):
+    """ Write (crc, pathname, size) tuples to a snapshot file, sorted by pathname.
+        size may be None when it is not known.
+        root is the folder relative pathnames are relative to, if any.
+        The file is written to a temporary file and then renamed.
+    """
+    folders = {}
+    for crc, pn, size in items:
+        folder, fn = split_folder(pn)
+        folders.setdefault(folder, []).append((fn, int(crc, 16),
+            unknown_size if size is None else size))
+
+    temp = filename + ".tmp"
+    with open(temp, 'wb') as f:
+        f.write(snapshot_header.pack(snapshot_magic, snapshot_version))
+        name = encode(root or "")
+        f.write(snapshot_root.pack(len(name)) + name)
+        previous = b""
+        for folder in sorted(folders):
+            files = sorted(folders[folder])
+            name = encode(folder)
+            same = shared_prefix(previous, name)
+            previous = name
+            crcs = array('I', [crc for fn, crc, size in files])
+            sizes = array('Q', [size for fn, crc, size in files])
+            if sys.byteorder == 'little':
+                crcs.byteswap()
+            else:
+                sizes.byteswap()
+            names = encode("\0".join(fn for fn, crc, size in files))
+            f.write(snapshot_folder.pack(len(files), same, len(name) - same, len(names)))
+            f.write(name[same:])
+            f.write(crcs.tobytes())
+            f.write(sizes.tobytes())
+            f.write(names)
+        f.write(snapshot_folder.pack(0, 0, 0, 0))
+    os.replace(temp, filename)
+
+def read_snapshot_root(filename):
+    """ Return the root folder saved in a snapshot, or None if it has none """
+    with open(filename, 'rb') as f:
+        tag, ver = snapshot_header.unpack(f.read(snapshot_header.size))
+        if tag != snapshot_magic or ver != snapshot_version:
+            raise Exception("{} is not a valid snapshot".format(filename))
+        length = snapshot_root.unpack(f.read(snapshot_root.size))[0]
+        return decode(f.read(length)) or None
+
+def iter_snapshot(filename):
+    """ Yield (crc, pathname, size) for every file in a snapshot, sorted by pathname.
+        size is None when it is not known.
+        Only one folder is held in memory at a time.
+        Raises an exception if the file is corrupted.
+    """
+    with open(filename, 'rb') as f:
+        tag, ver = snapshot_header.unpack(f.read(snapshot_header.size))
+        if tag != snapshot_magic or ver != snapshot_version:
+            raise Exception("{} is not a valid snapshot".format(filename))
+        f.seek(snapshot_root.unpack(f.read(snapshot_root.size))[0], os.SEEK_CUR)
+        previous = b""
+        while True:
+            count, same, length, names_length = snapshot_folder.unpack(
+                f.read(snapshot_folder.size))
+            if not count:
+                break
+            previous = previous[:same] + f.read(length)
+            crcs = f.read(count * 4).hex(' ', 4).upper().split()
+            sizes = array('Q')
+            sizes.frombytes(f.read(count * sizes.itemsize))
+            if sys.byteorder != 'little':
+                sizes.byteswap()
+            names = decode(f.read(names_length)).split("\0")
+            if len(previous) != same + length or len(crcs) != count or len(names) != count \
+                or len(sizes) != count:
+                raise Exception("{} is not a valid snapshot".format(filename))
+            if unknown_size in sizes:
+                sizes = [None if size == unknown_size else size for size in sizes]
+            yield from zip(crcs, map(decode(previous).__add__, names), sizes)
+
+def convert(folder, to_bin, recursive=True):
+    """ Convert the crc file in a folder (and its subfolders) between formats.
+        The original file is removed once the new one has been written.
+        Returns the number of files converted.
+    """
+    converted = 0
+    csv_pn = porting.addpath(folder, csv_filename)
+    bin_pn = porting.addpath(folder, bin_filename)
+    try:
+        if to_bin and os.path.isfile(csv_pn):
+            crcs = read_csv(csv_pn)
+            write_bin(bin_pn, crcs, file_stats(folder, crcs))
+            os.remove(csv_pn)
+            converted += 1
+        elif not to_bin and os.path.isfile(bin_pn):
+            write_csv(csv_pn, read_bin(bin_pn))
+            os.remove(bin_pn)
+            converted += 1
+    except Exception as e:
+        print('"{}": not converted: {}'.format(folder, e))
+
+    if recursive:
+        for entry in os.scandir(folder):
+            if entry.is_dir():
+                converted += convert(entry.path, to_bin, recursive)
+    return converted
+
+if __name__ == '__main__':
+    """ CrcFile -b [folders]
+        CrcFile -c [folders]
+        -b  Convert every crc.csv in a tree to crc.bin
+        -c  Convert every crc.bin in a tree back to crc.csv
+    """
+    if len(sys.argv) < 3 or sys.argv[1] not in ['-b', '-c']:
+        print("""
+    CrcFile -b [folders]    converts crc.csv files to crc.bin
+    CrcFile -c [folders]    converts crc.bin files to crc.csv""")
+        exit()
+    for arg in sys.argv[2:]:
+        count = convert(porting.abspath(arg), sys.argv[1] == '-b')
+        print("{:,} crc files converted in {}".format(count, arg))
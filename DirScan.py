@@ -0,0 +1,144 @@
+#-------------------------------------------------------------------------------
+# Name: DirScan
+# Purpose: List a folder once, keeping the type, size and modification
+#   time of every entry so callers never need to stat a file again.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import os, stat, sys
+from concurrent.futures import ThreadPoolExecutor
+
+class Entry:
+    """ The name, pathname and stat results for one file or folder """
+    __slots__ = ['name', 'path', 'st']
+
+    def __init__(self, name, path, st):
+        self.name = name
+        self.path = path
+        self.st = st
+
+    @property
+    def size(self):
+        return self.st.st_size
+
+    @property
+    def mtime(self):
+        return self.st.st_mtime
+
+def scan(folder, hidden=False):
+    """ List one folder using a single os.scandir pass.
+        Returns a tuple of (files, folders):
+            files is a dictionary of Entry objects for every file, by name.
+            folders is a list of Entry objects for every subfolder, sorted by name.
+        Like os.path.isfile and isdir, symbolic links are followed.
+        Entries that cannot be stat'ed (e.g. broken links) are ignored.
+        A folder that cannot be listed is treated as empty.
+        Like glob('*'), names starting with a period are skipped, unless
+        hidden is True.
+    """
+    files = {}
+    folders = []
+    try:
+        with os.scandir(folder) as it:
+            for de in it:
+                if de.name[0] == '.' and not hidden:
+                    continue
+                try:
+                    # is_dir() is usually answered by the listing itself.
+                    # stat() is cached by the DirEntry, and free on Windows.
+                    if de.is_dir():
+                        folders.append(Entry(de.name, de.path, None))
+                    else:
+                        st = de.stat()
+                        if stat.S_ISREG(st.st_mode):
+                            files[de.name] = Entry(de.name, de.path, st)
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    folders.sort(key=lambda entry: entry.name)
+    return files, folders
+
+def subfolders(folder, hidden=False):
+    """ List only the subfolders of a folder, sorted by name.
+        Unlike scan, files are never stat'ed.
+    """
+    folders = []
+    try:
+        with os.scandir(folder) as it:
+            for de in it:
+                if de.name[0] == '.' and not hidden:
+                    continue
+                try:
+                    if de.is_dir():
+                        folders.append(Entry(de.name, de.path, None))
+                except OSError:
+                    pass
+    except OSError:
+        pass
+    folders.sort(key=lambda entry: entry.name)
+    return folders
+
+def visit_folder(folder):
+    """ The default visit for walk: scan a folder and return its subfolders """
+    files, folders = scan(folder)
+    return (files, folders), [entry.path for entry in folders]
+
+def walk(top, workers=1, visit=visit_folder):
+    """ Walk a tree depth first, yielding (node, result) for every node.
+        visit(node) returns (result, children), where children is a list
+        of the nodes below it. By default nodes are folder pathnames and
+        results are the (files, folders) returned by scan.
+
+        With more than one worker, the nodes that will be yielded next are
+        visited in a thread pool, so many folders are listed at once.
+        That hides the round trip of each listing on a network share.
+        Only a few nodes per worker are read ahead, so the results waiting
+        to be yielded never grow with the size of the tree.
+        Results are still yielded in the order of a single threaded walk.
+    """
+    if workers <= 1:
+        stack = [top]
+        while stack:
+            node = stack.pop()
+            result, children = visit(node)
+            stack.extend(reversed(children))
+            yield node, result
+        return
+
+    limit = workers * 4     # nodes visited ahead of the caller
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        stack = [[top, None]]   # [node, future or None], the next node last
+        pending = 0
+        while stack:
+            node, future = stack.pop()
+            if future is None:
+                future = pool.submit(visit, node)
+            else:
+                pending -= 1
+            result, children = future.result()
+            stack.extend([child, None] for child in reversed(children))
+            for item in reversed(stack):
+                if pending >= limit:
+                    break
+                if item[1] is None:
+                    item[1] = pool.submit(visit, item[0])
+                    pending += 1
+            yield node, result
+
+if __name__ == '__main__':
+    """ DirScan [-r] [folders]
+        Print what one scan of each folder (or tree, with -r) finds.
+    """
+    recursive = sys.argv[1:2] == ['-r']
+    for arg in sys.argv[1+recursive:] or ['.']:
+        for folder, (files, folders) in walk(arg, 8) if recursive else [(arg, scan(arg))]:
+            for fn in sorted(files):
+                print('{},{},"{}"'.format(files[fn].size, int(files[fn].mtime), files[fn].path))
+            for entry in folders:
+                print('folder,,"{}"'.format(entry.path))
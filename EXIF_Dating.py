@@ -10,15 +10,73 @@
 #-------------------------------------------------------------------------------
 
 import glob, re, os, sys
-from PIL import Image
-from PIL.ExifTags import TAGS
-# sudo apt install python3.piexif
-import piexif
-
-today = ["2020", "08", "19", "12", "00", "00"]
+import ExifHeader
+try:
+    from PIL import Image   # only needed for files ExifHeader does not understand
+    from PIL.ExifTags import TAGS
+except ImportError:
+    Image = None
+try:
+    # sudo apt install python3.piexif
+    import piexif   # only needed by SetExifDate
+except ImportError:
+    piexif = None
+
+class MetadataCache:
+    """ Remembers the EXIF data of the files read during one run, so the
+        several questions asked about one picture only parse it once.
+        A file is identified by its pathname, size and modification time,
+        so a file that is changed is read again. SetExifDate also forgets
+        the files it writes, in case the time stamp does not change.
+        The dictionaries returned are shared, and must not be modified.
+    """
+    def __init__(self, limit=10000):
+        self.limit = limit  # the most files remembered
+        self.entries = {}   # (size, mtime_ns, exif) by pathname, oldest first
+
+    def get(self, pn, read):
+        """ Return the EXIF data of a file, calling read(pn) if it is not known """
+        try:
+            st = os.stat(pn)
+        except OSError:
+            return {}
+        entry = self.entries.get(pn)
+        if entry is not None and entry[:2] == (st.st_size, st.st_mtime_ns):
+            return entry[2]
+        exif = read(pn)
+        self.entries.pop(pn, None)
+        if len(self.entries) >= self.limit:
+            del self.entries[next(iter(self.entries))]
+        self.entries[pn] = (st.st_size, st.st_mtime_ns, exif)
+        return exif
+
+    def forget(self, pn):
+        """ Forget a file, e.g. because it was just written """
+        self.entries.pop(pn, None)
+
+metadata = MetadataCache()
 
 def get_exif(fn):
-    """ Get the EXIF data from a file, if it is available """
+    """ Get the EXIF data from a file, if it is available.
+        Each file is only read once while it is unchanged, see MetadataCache.
+    """
+    return metadata.get(fn, read_exif)
+
+def read_exif(fn):
+    """ Read the EXIF data from a file.
+        Usually only the tags used here are read from the file header.
+        Pillow decodes every tag of files ExifHeader does not understand,
+        including PNGs without an eXIf chunk, which may keep EXIF in text.
+    """
+    ret = ExifHeader.read_exif(fn)
+    if ret is not None:
+        return ret
+    if Image is None:
+        return {}
+    return pillow_exif(fn)
+
+def pillow_exif(fn):
+    """ Get all of the EXIF data from a file using Pillow """
     ret = {}
     try:
         i = Image.open(fn)
@@ -69,15 +127,21 @@ def GetExifDate(pn):
         " yyyy:mm:dd hh:mm:ss"
         m = re.search("([0-9]{4}):([0-9]{2}):([0-9]{2}) ([0-9]{2}):([0-9]{2}):([0-9]{2})", ret)
         if m is not None and len(m.groups())==6:
-            return list(m.groups())
+            return m.groups()
         m = re.search("([0-9]{4}):([0-9]{2}):([0-9]{2})", ret)
         if m is not None:
-            return list(m.groups())
+            return m.groups()
         return None
     return ret
 
 def SetExifDate(pn, date):
-    """ Add EXIF data to set a date """
+    """ Add EXIF data to set a date.
+        Only the EXIF data in a JPEG or PNG file is replaced, the picture
+        itself is copied byte for byte rather than decoded and re-encoded.
+        Raises ImportError if piexif is not installed.
+    """
+    if piexif is None:
+        raise ImportError("piexif is required to write EXIF dates")
     if len(date) == 6:
         dstr = date[0]+':'+date[1]+':'+date[2]+' '+date[3]+':'+date[4]+':'+date[5]
     else:
@@ -89,7 +153,13 @@ def SetExifDate(pn, date):
     try:
         exif = piexif.load(pn)
     except:
-        exif = {}
+        # piexif cannot open a PNG, but it can load the eXIf chunk itself
+        data = ExifHeader.exif_data(pn)
+        try:
+            exif = piexif.load(ExifHeader.exif_header + data) if data else {}
+        except:
+            exif = {}
+    exif.setdefault('Exif', {})
     dstr = bytes(dstr, 'utf-8')
     for tag in [DATE_TIME_ORIGINAL, DATE_TIME_DIGITIZED]:
         # The next two lines preserves the time found in Exif data
@@ -99,57 +169,71 @@ def SetExifDate(pn, date):
         exif['Exif'][tag] = dstr
     exif_encoded = piexif.dump(exif)
 
-    # Replace the original file with the new file and exif
-    im = Image.open(pn)
-    im.save(pn, "jpeg", exif=exif_encoded)
+    # Replace the original file with the new exif
+    try:
+        ExifHeader.write_exif(pn, exif_encoded)
+    finally:
+        metadata.forget(pn)
     return
 
-def GetFileDate(fn):
-    """ Use a series of regular expressions to extract the date from a filename """
-    global today
-
-    # Allow any separator in this list
-    sep = "[\\-\\._~ ]*?" # optional separators: the dash has to be escaped
-
-    # yyyy-mm-dd_hh-mm-ss (yyyy must start with 19 or 20)
-    yyyy = "(19[0-9][0-9]|20[0-9][0-9])"+sep
-    mm = dd = "([0-9][0-9])"+sep
-    hr = min = sec = "([0-9][0-9])"+sep
-    m = re.search("^"+yyyy+mm+dd+hr+min+sec, fn)
-    if m is not None:
-        for i in range(6):
-            if m.group(i+1) is not None:
-                today[i] = m.group(i+1)
-        return today
-
-    # IMG_yyyy-mm-dd_ (yyyy must start with 19 or 20)
-    m = re.search("^([A-Z])*?_"+yyyy+mm+dd, fn)
-    if m is not None:
-        for i in range(3):
-            if m.group(i+2) is not None:
-                today[i] = m.group(i+2)
-        return today[:3]
-
-    # yyyy-mm-dd_ (yyyy must start with 19 or 20)
-    m = re.search("^"+yyyy+mm+dd, fn)
-    if m is not None:
-        for i in range(3):
-            if m.group(i+1) is not None:
-                today[i] = m.group(i+1)
-        return today[:3]
-
+# Filename dates, tried in order. The separators are optional, any of
+# them are allowed, and years must start with 19 or 20.
+sep = "[\\-\\._~ ]*?" # optional separators: the dash has to be escaped
+yyyy = "(19[0-9][0-9]|20[0-9][0-9])"+sep
+nn = "([0-9][0-9])"+sep
+date_patterns = [
+    # yyyy-mm-dd_hh-mm-ss
+    (yyyy+nn+nn+nn+nn+nn, lambda g: g),
+    # IMG_yyyy-mm-dd_
+    ("(?:[A-Z])*?_"+yyyy+nn+nn, lambda g: g),
+    # yyyy-mm-dd_
+    (yyyy+nn+nn, lambda g: g),
     # mmddyyhhmm[a-f]*.
-    mm = dd = yy = hr = min = "([0-9][0-9])"
-    m = re.search("^"+mm+dd+yy+hr+min+"[a-f]*([-~(][0-9]*[)]*)*\\.", fn)
-    if m is not None:
-        today[0] = "20"+m.group(3)
-        today[1] = m.group(1)
-        today[2] = m.group(2)
-        today[3] = m.group(4)
-        today[4] = m.group(5)
-        return today
-
-    return None
+    ("([0-9][0-9])"*5+"[a-f]*(?:[-~(][0-9]*[)]*)*\\.",
+        lambda g: ("20"+g[2], g[0], g[1], g[3], g[4], "00")),
+    ]
+
+def compile_dates(patterns):
+    """ Compile the date patterns into one alternation, each in a group of
+        its own. The group that matched (lastindex) finds the fields of its date.
+        Returns the regex and (field groups, build) by the group of each pattern.
+    """
+    regex = re.compile("|".join("(" + pattern + ")" for pattern, build in patterns))
+    fields = {}
+    group = 1
+    for pattern, build in patterns:
+        count = re.compile(pattern).groups
+        fields[group] = (tuple(range(group + 1, group + 1 + count)), build)
+        group += count + 1
+    return regex, fields
+
+date_regex, date_fields = compile_dates(date_patterns)
+
+def GetFileDate(fn):
+    """ Use a series of regular expressions to extract the date from a filename.
+        Returns a tuple of strings, (YYYY, MM, DD) or (YYYY, MM, DD, HH, MM, SS),
+        or None if the filename has no date.
+    """
+    m = date_regex.match(fn)
+    if m is None:
+        return None
+    groups, build = date_fields[m.lastindex]
+    return build(m.group(*groups))
+
+def GetFileDates(filenames):
+    """ Date every filename in a folder listing, in one call.
+        Returns a list of the GetFileDate results, in the same order.
+    """
+    match, fields = date_regex.match, date_fields
+    dates = []
+    for fn in filenames:
+        m = match(fn)
+        if m is None:
+            dates.append(None)
+        else:
+            groups, build = fields[m.lastindex]
+            dates.append(build(m.group(*groups)))
+    return dates
 
 def main():
     GetFileDate('195907252004')
@@ -0,0 +1,437 @@
+#-------------------------------------------------------------------------------
+# Name: ExifHeader
+# Purpose: Read a few EXIF tags from the header of a JPEG, PNG or HEIC file,
+#   and replace the EXIF data of a JPEG or PNG, without opening it as an image.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import os, shutil, struct, sys, tempfile, zlib
+
+# The tags used by EXIF_Dating, named as PIL.ExifTags.TAGS names them
+wanted_tags = {
+    0x0100: 'ImageWidth',
+    0x0101: 'ImageLength',
+    0x9003: 'DateTimeOriginal',
+    0x9004: 'DateTimeDigitized',
+    0xA002: 'ExifImageWidth',
+    0xA003: 'ExifImageHeight',
+    }
+EXIF_IFD = 0x8769       # the tag in IFD0 that points to the Exif IFD
+type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 7: 1, 9: 4}   # BYTE, ASCII, SHORT, LONG, UNDEFINED, SLONG
+max_metadata = 1024 * 1024  # refuse to read more than this looking for EXIF data
+
+png_signature = b'\x89PNG\r\n\x1a\n'
+exif_header = b'Exif\x00\x00'
+
+def parse_tiff(data, tags=wanted_tags):
+    """ Decode some tags from EXIF data, a TIFF header and its IFDs.
+        Only IFD0 and the Exif IFD are searched, like Pillow's _getexif.
+        Returns a dictionary of values by tag name, or None if the data is corrupt.
+    """
+    order = {b'II': '<', b'MM': '>'}.get(data[:2])
+    if order is None or len(data) < 8 or struct.unpack(order + 'H', data[2:4])[0] != 42:
+        return None
+    ret = {}
+    ifds = [struct.unpack(order + 'I', data[4:8])[0]]
+    seen = set()
+    while ifds:
+        offset = ifds.pop()
+        if offset in seen or offset + 2 > len(data):
+            continue
+        seen.add(offset)
+        count = struct.unpack(order + 'H', data[offset:offset+2])[0]
+        for entry in range(offset + 2, min(offset + 2 + 12 * count, len(data) - 11), 12):
+            tag, kind, n = struct.unpack(order + 'HHI', data[entry:entry+8])
+            if tag == EXIF_IFD:
+                ifds.append(struct.unpack(order + 'I', data[entry+8:entry+12])[0])
+            if tag not in tags or kind not in type_sizes:
+                continue
+            size = type_sizes[kind] * n
+            start = entry + 8
+            if size > 4:
+                start = struct.unpack(order + 'I', data[start:start+4])[0]
+            value = data[start:start+size]
+            if len(value) < size:
+                continue
+            if kind == 2:
+                value = value.split(b'\x00', 1)[0].decode('latin-1')
+            elif kind in [3, 4, 9]:
+                code = {3: 'H', 4: 'I', 9: 'i'}[kind]
+                value = struct.unpack(order + code * n, value)
+                if n == 1:
+                    value = value[0]
+            ret[tags[tag]] = value
+    return ret
+
+def jpeg_exif(f):
+    """ Return the EXIF data from the APP1 segment of a JPEG, b'' if it has none.
+        Only the segment headers before the image data are read.
+    """
+    while True:
+        marker = f.read(4)
+        if len(marker) < 4 or marker[0] != 0xFF:
+            return None
+        if marker[1] in [0xD9, 0xDA]:   # end of image, start of scan
+            return b''
+        length = struct.unpack('>H', marker[2:])[0]
+        if length < 2:
+            return None
+        if marker[1] == 0xE1:
+            data = f.read(length - 2)
+            if data.startswith(exif_header):
+                return data[len(exif_header):]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+def png_exif(f):
+    """ Return the EXIF data from the eXIf chunk of a PNG.
+        Without an eXIf chunk None is returned rather than b'', as older
+        PNGs keep EXIF data in a "Raw profile type exif" text chunk instead.
+        The pixel data chunks are skipped, not read.
+    """
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, kind = struct.unpack('>I4s', header)
+        if kind == b'IEND':
+            return None
+        if kind == b'eXIf':
+            if length > max_metadata:
+                return None
+            data = f.read(length)
+            return data[len(exif_header):] if data.startswith(exif_header) else data
+        f.seek(length + 4, os.SEEK_CUR)     # the data and its crc
+
+def boxes(data, start=0, end=None):
+    """ Yield (type, start, end) for every ISO base media box in data """
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack('>I4s', data[start:start+8])
+        header = 8
+        if size == 1:
+            size = struct.unpack('>Q', data[start+8:start+16])[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            return
+        yield kind, start + header, start + size
+        start += size
+
+def heic_exif(f):
+    """ Return the EXIF data of a HEIC (ISO base media) file, b'' if it has none.
+        The meta box says where the Exif item is, so only it is read.
+    """
+    # Find the meta box at the top level, reading only box headers
+    f.seek(0)
+    while True:
+        header = f.read(16)
+        if len(header) < 8:
+            return None
+        size, kind = struct.unpack('>I4s', header[:8])
+        if size == 1:
+            size = struct.unpack('>Q', header[8:16])[0]
+        if kind == b'meta':
+            break
+        if size < 8:
+            return None
+        f.seek(size - len(header), os.SEEK_CUR)
+    if size < 8 or size > max_metadata:
+        return None
+    f.seek(-len(header), os.SEEK_CUR)
+    meta = f.read(size)
+
+    # meta is a full box, with 4 bytes of version and flags before its boxes
+    children = {kind: (start, end) for kind, start, end in boxes(meta, 12)}
+    if b'iinf' not in children or b'iloc' not in children:
+        return b''
+
+    # The item info box gives the ID of the Exif item
+    start, end = children[b'iinf']
+    version = meta[start]
+    start += 6 if version == 0 else 8
+    exif_id = None
+    for kind, start, end in boxes(meta, start, end):
+        if kind == b'infe' and meta[start] >= 2:
+            if meta[start] == 2:
+                item_id, item_type = struct.unpack('>H2x4s', meta[start+4:start+12])
+            else:
+                item_id, item_type = struct.unpack('>I2x4s', meta[start+4:start+14])
+            if item_type == b'Exif':
+                exif_id = item_id
+                break
+    if exif_id is None:
+        return b''
+
+    # The item location box gives the offset and length of that item
+    start, end = children[b'iloc']
+    version = meta[start]
+    offset_size, length_size = meta[start+4] >> 4, meta[start+4] & 15
+    base_size, index_size = meta[start+5] >> 4, meta[start+5] & 15
+    if version < 1:
+        index_size = 0
+    pos = start + 6
+
+    def number(size):
+        nonlocal pos
+        value = int.from_bytes(meta[pos:pos+size], 'big')
+        pos += size
+        return value
+
+    count = number(2 if version < 2 else 4)
+    for item in range(count):
+        item_id = number(2 if version < 2 else 4)
+        method = number(2) & 15 if version in [1, 2] else 0
+        number(2)   # data reference index
+        base = number(base_size)
+        extents = [(number(index_size), number(offset_size), number(length_size))
+            for extent in range(number(2))]
+        if item_id != exif_id:
+            continue
+        if method != 0 or len(extents) != 1 or extents[0][2] > max_metadata:
+            return None     # only data in the file itself is supported
+        f.seek(base + extents[0][1])
+        data = f.read(extents[0][2])
+        # The item starts with the offset of the TIFF header after that field
+        if len(data) < 4:
+            return None
+        skip = 4 + struct.unpack('>I', data[:4])[0]
+        return data[skip:]
+    return None
+
+def exif_data(pn):
+    """ Read the EXIF data (a TIFF header and its IFDs) from a JPEG, PNG or
+        HEIC file. Returns b'' if the file has no EXIF data, or None if the
+        file is not understood.
+    """
+    try:
+        with open(pn, 'rb') as f:
+            signature = f.read(12)
+            if signature[:2] == b'\xFF\xD8':
+                f.seek(2)
+                data = jpeg_exif(f)
+            elif signature[:8] == png_signature:
+                f.seek(8)
+                data = png_exif(f)
+            elif signature[4:8] == b'ftyp':
+                data = heic_exif(f)
+            else:
+                return None
+    except (OSError, struct.error, IndexError):
+        return None
+    return data
+
+def read_exif(pn, tags=wanted_tags):
+    """ Read some EXIF tags from a JPEG, PNG or HEIC file.
+        Returns a dictionary of values by tag name, which is empty if the
+        file has no EXIF data, or None if the file is not understood.
+    """
+    data = exif_data(pn)
+    if data is None:
+        return None
+    if not data:
+        return {}
+    return parse_tiff(data, tags)
+
+def copy_bytes(f, out, count):
+    """ Copy count bytes from one file to another """
+    while count > 0:
+        data = f.read(min(count, 1024 * 1024))
+        if not data:
+            raise ValueError("{}: file is truncated".format(f.name))
+        out.write(data)
+        count -= len(data)
+
+def splice_jpeg(f, out, data):
+    """ Copy the segments before the image data of a JPEG, replacing its
+        EXIF APP1 segment. The new segment follows any JFIF APP0 segment.
+    """
+    app1 = exif_header + data
+    if len(app1) + 2 > 0xFFFF:
+        raise ValueError("{}: EXIF data is too large for a JPEG".format(f.name))
+    app1 = b'\xFF\xE1' + struct.pack('>H', len(app1) + 2) + app1
+    out.write(b'\xFF\xD8')
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise ValueError("{}: corrupt JPEG".format(f.name))
+        if marker[1] != 0xE0 and app1:
+            out.write(app1)
+            app1 = None
+        if marker[1] in [0xD9, 0xDA]:   # end of image, start of scan
+            out.write(marker)
+            return
+        header = f.read(2)
+        length = struct.unpack('>H', header)[0]
+        segment = f.read(length - 2)
+        if marker[1] == 0xE1 and segment.startswith(exif_header):
+            continue    # the old EXIF data
+        out.write(marker + header + segment)
+
+def splice_png(f, out, data):
+    """ Copy the chunks of a PNG, replacing its eXIf chunk.
+        The new chunk precedes the image data.
+    """
+    exif = b'eXIf' + data
+    exif = struct.pack('>I', len(data)) + exif + struct.pack('>I', zlib.crc32(exif))
+    out.write(png_signature)
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            raise ValueError("{}: corrupt PNG".format(f.name))
+        length, kind = struct.unpack('>I4s', header)
+        if kind == b'eXIf':
+            f.seek(length + 4, os.SEEK_CUR)     # the old EXIF data
+            continue
+        if kind in [b'IDAT', b'IEND'] and exif:
+            out.write(exif)
+            exif = None
+        out.write(header)
+        copy_bytes(f, out, length + 4)
+        if kind == b'IEND':
+            return
+
+def write_exif(pn, data):
+    """ Replace the EXIF data of a JPEG or PNG file without decoding its image.
+        data is a TIFF header and IFDs, optionally preceded by exif_header
+        as piexif.dump returns it. Every other byte of the file is copied
+        unchanged to a temporary file, which then replaces the original.
+    """
+    if data.startswith(exif_header):
+        data = data[len(exif_header):]
+    folder, fn = os.path.split(pn)
+    fd, temp = tempfile.mkstemp(dir=folder or '.', prefix=fn + '.', suffix='.tmp')
+    try:
+        with open(fd, 'wb') as out, open(pn, 'rb') as f:
+            signature = f.read(8)
+            if signature[:2] == b'\xFF\xD8':
+                f.seek(2)
+                splice_jpeg(f, out, data)
+            elif signature == png_signature:
+                splice_png(f, out, data)
+            else:
+                raise ValueError("{}: only JPEG and PNG files can be written".format(pn))
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        shutil.copymode(pn, temp)
+        os.replace(temp, pn)
+    except:
+        os.remove(temp)
+        raise
+
+def image_data(pn):
+    """ Return the picture itself: the bytes of a JPEG from its start of
+        scan, or the IDAT chunks of a PNG. Used to check write_exif.
+    """
+    with open(pn, 'rb') as f:
+        signature = f.read(8)
+        f.seek(2 if signature[:2] == b'\xFF\xD8' else 8)
+        if signature[:2] == b'\xFF\xD8':
+            with open(os.devnull, 'wb') as out:
+                splice_jpeg(f, out, b'')
+            return f.read()
+        data = b''
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                return data
+            length, kind = struct.unpack('>I4s', header)
+            chunk = f.read(length + 4)
+            if kind == b'IDAT':
+                data += header + chunk
+
+def build_tiff(values, order='<'):
+    """ Create EXIF data holding some tags, a minimal TIFF header and IFDs.
+        values is a dictionary by tag name, holding strings or integers.
+        Used to test parse_tiff, and by Benchmarks.py.
+    """
+    numbers = {name: tag for tag, name in wanted_tags.items()}
+    ifd0 = sorted(numbers[name] for name in values if numbers[name] < EXIF_IFD)
+    exif = sorted(numbers[name] for name in values if numbers[name] > EXIF_IFD)
+    if exif:
+        ifd0.append(EXIF_IFD)
+    exif_offset = 8 + 2 + 12 * len(ifd0) + 4
+    extra_offset = exif_offset + (2 + 12 * len(exif) + 4 if exif else 0)
+    extra = b''
+
+    def ifd(tags):
+        nonlocal extra
+        data = struct.pack(order + 'H', len(tags))
+        for tag in tags:
+            if tag == EXIF_IFD:
+                data += struct.pack(order + 'HHII', tag, 4, 1, exif_offset)
+                continue
+            value = values[wanted_tags[tag]]
+            if isinstance(value, int):
+                data += struct.pack(order + 'HHII', tag, 4, 1, value)
+            else:
+                value = value.encode('latin-1') + b'\x00'
+                data += struct.pack(order + 'HHII', tag, 2, len(value), extra_offset + len(extra))
+                extra += value
+        return data + b'\x00\x00\x00\x00'   # no next IFD
+
+    data = ifd(ifd0) + (ifd(exif) if exif else b'')
+    return (b'II' if order == '<' else b'MM') + struct.pack(order + 'HI', 42, 8) + data + extra
+
+if __name__ == '__main__':
+    """ ExifHeader [files]
+        Print the EXIF tags found in each file, or test this module.
+    """
+    if sys.argv[1:]:
+        for pn in sys.argv[1:]:
+            print("{}: {}".format(pn, read_exif(pn)))
+        exit()
+
+    values = {'DateTimeOriginal': '2020:08:19 12:34:56', 'ExifImageWidth': 4032,
+        'ExifImageHeight': 3024, 'ImageWidth': 640}
+    tiff = build_tiff(values, '>')
+    print("{}: parse_tiff".format("OK" if parse_tiff(tiff) == values else "ERROR"))
+    folder = tempfile.mkdtemp(prefix="ExifHeader.")
+    app1 = exif_header + build_tiff(values)
+    samples = {
+        "a.jpg": b'\xFF\xD8\xFF\xE0\x00\x04JF\xFF\xE1' + struct.pack('>H', len(app1) + 2) + app1
+            + b'\xFF\xDA\x00\x02' + os.urandom(1000) + b'\xFF\xD9',
+        "b.jpg": b'\xFF\xD8\xFF\xDA\x00\x02' + os.urandom(1000) + b'\xFF\xD9',
+        "c.png": png_signature + struct.pack('>I4s', 1000, b'IDAT') + os.urandom(1004)
+            + struct.pack('>I4s', len(tiff), b'eXIf') + tiff + b'\x00' * 4
+            + struct.pack('>I4s', 0, b'IEND') + b'\x00' * 4,
+        "f.png": png_signature + struct.pack('>I4s', 1000, b'IDAT') + os.urandom(1004)
+            + struct.pack('>I4s', 0, b'IEND') + b'\x00' * 4,
+        "d.txt": b'not a picture',
+        }
+
+    def box(kind, data):
+        return struct.pack('>I4s', len(data) + 8, kind) + data
+
+    ftyp = box(b'ftyp', b'heic\x00\x00\x00\x00mif1heic')
+    infe = box(b'infe', b'\x02\x00\x00\x00' + struct.pack('>HH4s', 7, 0, b'Exif'))
+    iinf = box(b'iinf', b'\x00\x00\x00\x00' + struct.pack('>H', 1) + infe)
+    item = struct.pack('>I', 6) + app1
+    iloc_size = 8 + 4 + 2 + 2 + 2 + 2 + 2 + 8
+    offset = len(ftyp) + 8 + 4 + len(iinf) + iloc_size + 8
+    iloc = box(b'iloc', b'\x00\x00\x00\x00\x44\x00' + struct.pack('>HHHHII', 1, 7, 0, 1, offset, len(item)))
+    samples["e.heic"] = ftyp + box(b'meta', b'\x00\x00\x00\x00' + iinf + iloc) + box(b'mdat', item)
+    expected = {"a.jpg": values, "b.jpg": {}, "c.png": values, "d.txt": None, "e.heic": values,
+        "f.png": None}
+    for fn, data in samples.items():
+        pn = os.path.join(folder, fn)
+        with open(pn, 'wb') as f:
+            f.write(data)
+        ret = read_exif(pn)
+        print("{}: {} {}".format("OK" if ret == expected[fn] else "ERROR", fn, ret))
+
+        # Change the date, leaving the picture exactly as it was
+        if fn.endswith(('.jpg', '.png')):
+            before = image_data(pn)
+            changed = dict(values, DateTimeOriginal='1959:07:25 20:04:00')
+            write_exif(pn, build_tiff(changed))
+            ret = read_exif(pn)
+            print("{}: write_exif {} {}".format("OK" if ret == changed and image_data(pn) == before
+                else "ERROR", fn, ret))
+        os.remove(pn)
+    os.rmdir(folder)
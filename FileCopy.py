@@ -0,0 +1,159 @@
+#-------------------------------------------------------------------------------
+# Name: FileCopy
+# Purpose: Copy files while computing their CRC32, so each file is read
+#   once and written once.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import errno, os, sys, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import crc32
+
+try:
+    import fcntl    # reflinks are a Linux feature
+except ImportError:
+    fcntl = None
+
+FICLONE = 0x40049409    # ioctl that shares the data of one file with another
+kernel_blocksize = 64 * 1024 * 1024
+
+# Copy methods, see Benchmarks.py copy.
+#   stream          read and write through Python, computing the CRC on the way
+#   reflink         share the data on file systems that support it (btrfs, xfs)
+#   copy_file_range copy within the kernel, possibly offloaded to the device
+#   sendfile        copy within the kernel
+#   auto            try reflink, copy_file_range and sendfile, then stream
+copy_methods = ['stream', 'reflink', 'copy_file_range', 'sendfile', 'auto']
+
+# Errors that mean a method is not supported here, rather than a real failure
+unsupported = {errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL,
+    errno.ENOTTY, errno.EBADF, errno.EPERM}
+
+def copy_with_crc(src, dst, reread=False):
+    """ Copy the data in one file (like shutil.copyfile) and return its CRC32.
+        The CRC is computed from the bytes as they are written.
+        When reread is True the destination is read back and checked,
+        raising an exception if it does not match.
+    """
+    crc = 0
+    buffer = bytearray(crc32.blocksize)
+    with memoryview(buffer) as view:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            while True:
+                count = fsrc.readinto(buffer)
+                if not count:
+                    break
+                crc = zlib.crc32(view[:count], crc)
+                fdst.write(view[:count])
+    crc = "%08X" % (crc & 0xFFFFFFFF)
+    if reread and crc32.crc32(dst) != crc:
+        raise Exception("{}: copy does not match".format(dst))
+    return crc
+
+def copy_kernel(src, dst, method):
+    """ Copy the data in one file without passing it through Python.
+        Raises OSError (or AttributeError on other platforms) when the
+        kernel or file system does not support the method.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if method == 'reflink':
+            if fcntl is None:
+                raise OSError(errno.ENOSYS, "reflinks are not supported")
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        elif method == 'copy_file_range':
+            while os.copy_file_range(fsrc.fileno(), fdst.fileno(), kernel_blocksize):
+                pass
+        elif method == 'sendfile':
+            offset = 0
+            while True:
+                count = os.sendfile(fdst.fileno(), fsrc.fileno(), offset, kernel_blocksize)
+                if not count:
+                    break
+                offset += count
+        else:
+            raise ValueError("unknown copy method: {}".format(method))
+
+def copy_file(src, dst, method='stream', crc=None, reread=False):
+    """ Copy the data in one file using one of the copy_methods.
+        Methods other than stream fall back to stream when they are refused.
+        crc is the expected CRC of the source, if it is known.
+        Returns the CRC of the copy:
+            stream computes it while copying.
+            The other methods return crc, unless reread is True, in which
+            case the destination is hashed (and checked against crc).
+    """
+    if method == 'auto':
+        methods = ['reflink', 'copy_file_range', 'sendfile']
+    elif method == 'stream':
+        methods = []
+    else:
+        methods = [method]
+
+    for method in methods:
+        try:
+            copy_kernel(src, dst, method)
+        except AttributeError:  # os.copy_file_range or os.sendfile is missing
+            continue
+        except OSError as e:
+            if e.errno in unsupported:
+                continue
+            raise
+        if reread:
+            copied = crc32.crc32(dst)
+            if crc is not None and copied != crc:
+                raise Exception("{}: copy does not match".format(dst))
+            return copied
+        return crc
+
+    # The CRC of what was actually written wins, even if the source changed
+    return copy_with_crc(src, dst, reread)
+
+def _copy_or_none(src, dst, method, crc, reread):
+    """ Copy one file, returning None on failure """
+    try:
+        return copy_file(src, dst, method, crc, reread)
+    except:
+        return None
+
+def copy_many(items, workers=1, method='stream', reread=False):
+    """ Copy many files, several files at a time.
+        items is a sequence of (source, destination, crc) tuples where crc
+        is the expected CRC of the source, or None when it is unknown.
+        Yields (source, destination, crc) tuples in the same order as items.
+        crc is None when a file could not be copied.
+
+        Only a few files per worker are ever in flight, so small files on
+        slow (e.g. USB) disks stop waiting on each other one at a time.
+    """
+    if workers <= 1:
+        for src, dst, crc in items:
+            yield src, dst, _copy_or_none(src, dst, method, crc, reread)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for src, dst, crc in items:
+            pending.append((src, dst,
+                pool.submit(_copy_or_none, src, dst, method, crc, reread)))
+            if len(pending) >= workers * 4:
+                src, dst, future = pending.popleft()
+                yield src, dst, future.result()
+        while pending:
+            src, dst, future = pending.popleft()
+            yield src, dst, future.result()
+
+if __name__ == '__main__':
+    """ FileCopy source destination [method]
+        Copy one file and print its CRC.
+    """
+    if len(sys.argv) not in [3, 4] or sys.argv[3:] and sys.argv[3] not in copy_methods:
+        print("FileCopy source destination [{}]".format(" | ".join(copy_methods)))
+        exit()
+    method = sys.argv[3] if len(sys.argv) == 4 else 'stream'
+    print(copy_file(sys.argv[1], sys.argv[2], method, reread=True))
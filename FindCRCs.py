@@ -10,27 +10,56 @@
 # Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 #-------------------------------------------------------------------------------
 
-import glob, os, re, sys
+import atexit, os, sys
 from JsonFile import JsonFile
 from Logging import timespent, logging
 from CmdFile import CmdFile
+import zlib
+import CrcFile, DirScan
+from crc32 import crc32
+from HashCache import HashCache
+from ContentIndex import ContentIndex, SortedRuns
 
 log = None
 cmdfile = None
 szDuplicates = "duplicate file"
 stats = {szDuplicates:0}
+errors = {}
 order_switched = False
+index = None    # the ContentIndex (or SortedRuns) used unless -q is given
+confirming = True   # -q: trust the CRC alone
+memory_limit = None # -m N: the megabytes SortedRuns may use
+workers = 1         # -j N: folders listed at the same time
+scanning = False    # -d: scan folders for duplicates instead of reading crc files
+sizes = {}      # pathnames by size, collected by -d
+files_scanned = 0   # files listed by -d
+cache = None    # -d: remembers crcs across runs (shared with PyBackup), unless -n is used
+partial_size = 64 * 1024    # bytes hashed at each end of a file by -d
+bytes_hashed = 0
 
 def help():
     global log, cmdfile
     print("""
-    Find-CRCs [-s] [-r] [folders] [-w]
+    Find-CRCs [-j N] [-q] [-m N] [-s] [-r] [folders] [-w]
+    Find-CRCs -d [-n] [-j N] [-q] [-s] [folders]
 
+    -d  Scan the folders for duplicate files without using crc files.
+        Files are grouped by size and only files sharing a size are read:
+        first the start and end of each file, then the whole file.
+        Whole file CRCs are remembered in ~/PyBackup.cache.db.
+    -n  Do not use (or update) ~/PyBackup.cache.db.
+    -q  Quick: trust the CRC alone, as older versions did.
+        By default files are indexed by size and CRC on disk and every
+        match is confirmed by a stronger hash before it is reported.
+    -j N  List N folders at the same time, which helps on network shares.
+    -m N  Sort the CRCs in temporary files using no more than about
+        N megabytes of memory, however many files there are.
     -s  Switch the order files are displayed when duplicates are found.
-    -r  Reloads a saved set of CRC files from a master json file.
-    -w  (Re)creates that master json file.
+    -r  Reloads a saved set of CRC files from a master snapshot file.
+    -w  (Re)creates that master snapshot file.
 
-    Every other parameter should be that of a folder containing crc.csv files.
+    Every other parameter should be that of a folder containing crc.csv
+    (or crc.bin) files.
 
     *** WARNING ***
     Pathnames saved with -w may be relative. Do not change directories
@@ -58,42 +87,198 @@ def record_duplicate(original, duplicate):
         cmdfile.command(duplicate, original)
     log.increment(stats, szDuplicates)
 
-def AddCrc(crcs, filename):
-    """ Add CRC values from one file """
+def AddCrc(crcs, filename, files=None):
+    """ Add CRC values from one file.
+        files is the scan of its folder, when the caller already has one.
+    """
     global log, cmdfile, szDuplicates, stats, order_switched
-    try:
-        f = open(filename)
-    except: # open may not find the file
+    if index is not None:
+        IndexCrcs(filename, files)
         return crcs
+    try:
+        lines = CrcFile.iter_crcs(filename)
+        rootp, crcfn = os.path.split(filename)
+        for crc, fn in lines:
+            pn = rootp + '\\' + fn
+            if crc in crcs:
+                record_duplicate(crcs[crc], pn)
+            else:
+                crcs[crc] = pn
+                log.increment(stats, "original file")
+    except OSError: # open may not find the file
+        pass
+    except:
+        log.error(errors, "corrupted crc file", filename)
+    return crcs
 
-    rootp, crcfn = os.path.split(filename)
-    for line in f:
-        # First match a quoted pathname, if possible
-        m = re.match('([0-9A-F]{8}),"(.*?)"', line)
-        # If that fails, match a pathname with no quotes
-        if m == None:
-            m = re.match('([0-9A-F]{8}),(.*)', line)
-        crc = m.group(1)
-        pn = rootp + '\\' + m.group(2)
-        if crc in crcs:
-            record_duplicate(crcs[crc], pn)
-        else:
-            crcs[crc] = pn
-            log.increment(stats, "original file")
-    f.close()
+def IndexCrcs(filename, files=None):
+    """ Add the files listed in one crc file to the content index.
+        One listing of the folder provides the size of every file.
+        Files that no longer exist are left out.
+    """
+    global log, stats, index
+    try:
+        rootp, crcfn = os.path.split(filename)
+        lines = CrcFile.iter_crcs(filename)
+        if files is None:
+            files, folders = DirScan.scan(rootp)
+        for crc, fn in lines:
+            entry = files.get(fn)
+            if entry is None:
+                log.increment(stats, "missing file")
+                continue
+            try:
+                index.add(entry.path, crc, entry.size)
+            except UnicodeEncodeError:  # a name that is not valid utf-8
+                log.increment(errors, "unindexable name")
+    except OSError: # open may not find the file
+        pass
+    except:
+        log.error(errors, "corrupted crc file", filename)
+
+def ReadSnapshot(crcs, filename):
+    """ Add the files saved in a master snapshot file.
+        A master json file written by older versions is read if there
+        is no snapshot yet.
+    """
+    global log, stats, index
+    if os.path.exists(filename) or not os.path.exists(legacy_filename):
+        items = CrcFile.iter_snapshot(filename)
+    else:
+        items = ((crc, pn, None) for crc, pn in JsonFile(legacy_filename).read().items())
+    for crc, pn, size in items:
+        if index is None:
+            crcs.setdefault(crc, pn)
+            continue
+        try:
+            index.add(pn, crc, os.stat(pn).st_size if size is None else size)
+        except OSError:
+            log.increment(stats, "missing file")
     return crcs
 
+def ReportDuplicates():
+    """ Record every confirmed duplicate in the content index.
+        Files that share a size and crc but differ are only counted.
+    """
+    global log, stats, index
+    for group in index.groups():
+        confirmed = index.confirm(group) if confirming else [group]
+        if sum(len(files) for files in confirmed) < len(group):
+            log.increment(stats, "crc collision")
+        for files in confirmed:
+            for duplicate in files[1:]:
+                record_duplicate(files[0], duplicate)
+
+def files_found():
+    """ The number of files found, for the summary.
+        Files in the content index are not counted in stats.
+    """
+    global log, stats, index, scanning, files_scanned
+    if scanning:
+        return files_scanned
+    if index is not None and len(index):
+        return len(index)
+    return log.sum(stats)
+
+def ScanFolder(folder):
+    """ Group every file in a directory tree by size """
+    global sizes, files_scanned
+    for pn, (files, folders) in DirScan.walk(folder, workers):
+        for fn in sorted(files):
+            if fn not in [CrcFile.csv_filename, CrcFile.bin_filename]:
+                sizes.setdefault(files[fn].size, []).append(files[fn].path)
+                files_scanned += 1
+
+def partial_crc(pn, size):
+    """ Return the CRC32 of the start and end of a file """
+    global bytes_hashed
+    with open(pn, 'rb') as fh:
+        rdata = fh.read(partial_size)
+        if size > 2 * partial_size:
+            fh.seek(-partial_size, os.SEEK_END)
+        rdata += fh.read(partial_size)
+    bytes_hashed += len(rdata)
+    return zlib.crc32(rdata)
+
+def full_crc(pn, size):
+    """ Return the CRC32 of a whole file, only reading it if it is not cached """
+    global bytes_hashed, cache
+    if cache is None:
+        crc, hashed = crc32(pn), True
+    else:
+        crc, hashed = cache.crc32(pn)
+    if hashed:
+        bytes_hashed += size
+    return crc
+
+def same_hash(hash, pathnames, size):
+    """ Split a list of pathnames into groups of files with the same hash.
+        Files that cannot be read are left out.
+    """
+    groups = {}
+    for pn in pathnames:
+        try:
+            groups.setdefault(hash(pn, size), []).append(pn)
+        except OSError:
+            log.increment(stats, "unreadable file")
+    return [group for group in groups.values() if len(group) > 1]
+
+def ScanDuplicates():
+    """ Find the duplicates among the files collected by ScanFolder.
+        A file with a unique size cannot have a duplicate and is never read.
+        The partial CRC covers small files completely, larger files are
+        read in full only when the start and end of another file match.
+    """
+    global log, stats, sizes, index
+    for size, pathnames in sizes.items():
+        if len(pathnames) < 2:
+            log.increment(stats, "unique size")
+            continue
+        for group in same_hash(partial_crc, pathnames, size):
+            if size > 2 * partial_size:
+                groups = same_hash(full_crc, group, size)
+            else:
+                groups = [group]
+            for group in groups:
+                # Unless -q was given, matches are confirmed like ReportDuplicates
+                if confirming:
+                    confirmed = index.confirm(group)
+                    if sum(len(files) for files in confirmed) < len(group):
+                        log.increment(stats, "crc collision")
+                else:
+                    confirmed = [group]
+                for files in confirmed:
+                    for duplicate in files[1:]:
+                        record_duplicate(files[0], duplicate)
+    sizes = {}
+    log.msg("{:,} bytes read to find duplicates".format(bytes_hashed))
+
 def FindCrcs(crcs, folder):
-    """ Combine all crcs together from a directory tree """
+    """ Combine all crcs together from a directory tree.
+        With -j folders are listed by several threads at once, but
+        crc files are still read in the same (depth first) order.
+    """
     global log, cmdfile, szDuplicates, stats, order_switched
-    count = len(crcs)
-    for pn in glob.glob(glob.escape(folder)+'/*'):
-        rootp, fn = os.path.split(pn)
-        if fn == "crc.csv":
-            crcs = AddCrc(crcs, pn)
-        elif os.path.isdir(pn):
-            crcs = FindCrcs(crcs, pn)
-    log.msg("{:,}: crcs added from {}".format(len(crcs)-count, cmdfile.log.nickname(folder)))
+
+    def added():
+        return len(index) if index is not None else len(crcs)
+
+    def finished(pn, count):
+        log.msg("{:,}: crcs added from {}".format(added()-count, cmdfile.log.nickname(pn)))
+
+    # Folders still being walked, with the count when each was started
+    pending = []
+    for pn, (files, folders) in DirScan.walk(folder, workers):
+        while pending and not pn.startswith(os.path.join(pending[-1][0], "")):
+            finished(*pending.pop())
+        pending.append((pn, added()))
+        # Either kind of crc file is read, crc.csv when a folder has both
+        for fn in [CrcFile.csv_filename, CrcFile.bin_filename]:
+            if fn in files:
+                crcs = AddCrc(crcs, files[fn].path, files)
+                break
+    while pending:
+        finished(*pending.pop())
     return crcs
 
 if __name__ == '__main__':
@@ -101,12 +286,44 @@ if __name__ == '__main__':
 
     # (Re)Create the pathnames (and files) used by this programe
     log = logging("FindCRCs.txt")
-    jsonfile = JsonFile("FindCRCs.json")
+    snapshot_filename = os.path.abspath("FindCRCs.snapshot")
+    legacy_filename = os.path.abspath("FindCRCs.json")
     cleanscript_filename = "RemoveDuplicates.cmd"
     cmdfile = CmdFile(cleanscript_filename)
     processed = []
     crcs = {}
 
+    # Options that change how every folder is handled
+    use_cache = True
+    argv = sys.argv[:1]
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg in ['-q', '-Q']:
+            confirming = False
+        elif arg in ['-d', '-D']:
+            scanning = True
+        elif arg in ['-n', '-N']:
+            use_cache = False
+        elif arg[:2] in ['-j', '-J']:
+            try:
+                workers = int(arg[2:] or next(args, ''))
+            except ValueError:
+                help()
+        elif arg[:2] in ['-m', '-M']:
+            try:
+                memory_limit = int(arg[2:] or next(args, ''))
+            except ValueError:
+                help()
+        else:
+            argv.append(arg)
+    if memory_limit:
+        index = SortedRuns(memory_limit * 1024 * 1024)
+    elif confirming:
+        index = ContentIndex()
+    if scanning and use_cache:
+        cache = HashCache()
+        atexit.register(cache.close)
+
     # Start off the command file with a few details.
     # But provide comments in that file in case the original files should be removed instead.
     rootp, cmdline = os.path.split(sys.argv[0])
@@ -118,30 +335,40 @@ if __name__ == '__main__':
     cmdfile.remark("Pick which files to remove.", silent=True)
 
     # Combine as many folders and requested
-    if len(sys.argv) > 1:
-        for arg in sys.argv[1:]:
+    if len(argv) > 1:
+        for arg in argv[1:]:
             if arg in ['-?', '/?', '-h', '-H']:
                 help()
             elif arg in ['-r', '-R', '/r', '/R']:
-                crcs = jsonfile.read()
-                log.msg("Read jsonfile")
+                crcs = ReadSnapshot(crcs, snapshot_filename)
+                log.msg("Read snapshot")
             elif arg in ['-w', '-W', '/w', '/W']:
-                jsonfile.write(crcs)
-                log.msg("Wrote jsonfile")
+                CrcFile.write_snapshot(snapshot_filename, index.items() if index is not None
+                    else ((crc, pn, None) for crc, pn in crcs.items()))
+                log.msg("Wrote snapshot")
             elif arg in ['-s', '-S']:
                 order_switched = True
             else:
                 pn= os.path.expandvars(arg) # expand but leave relative, maybe
-                if os.path.isdir(pn):
+                if os.path.isdir(pn) and scanning:
+                    ScanFolder(pn)
+                    processed += [os.path.abspath(pn)]
+                elif os.path.isdir(pn):
                     crcs = FindCrcs(crcs, pn)
                     processed += [os.path.abspath(pn)]
                 else:
                     help()
 
+    if scanning:
+        ScanDuplicates()
+    if index is not None:
+        ReportDuplicates()
+        index.close()
     log.msg("FindCrcs complete.")
     log.counters(stats)
+    log.counters(errors)
     if stats[szDuplicates] == 0:
-        log.msg("No duplicates found in {:,} files".format(log.sum(stats)))
+        log.msg("No duplicates found in {:,} files".format(files_found()))
         cmdfile.remove()
     else:
         # Add an all important command at the end of the cleanscript
@@ -151,5 +378,5 @@ if __name__ == '__main__':
             pybackup_update += ' ' + folder
         cmdfile.remark(pybackup_update, "PyBackup -u ")
         cmdfile.remark("{:,} Duplicates found.  {} ?".format(stats[szDuplicates], cleanscript_filename))
-    cmdfile.remark("{:,} CRCs found.".format(log.sum(stats)))
+    cmdfile.remark("{:,} CRCs found.".format(files_found()))
     cmdfile.remark("Completed in {}".format(timespent()))
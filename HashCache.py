@@ -0,0 +1,144 @@
+#-------------------------------------------------------------------------------
+# Name: HashCache
+# Purpose: Remember the CRC of every file hashed so unchanged files
+#   never need to be read again, even by a later run.
+#
+# Author: John Eichenberger
+#
+# Created:     18/10/2026
+# Copyright:   (c) John Eichenberger 2026
+# Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
+#-------------------------------------------------------------------------------
+
+import os, sqlite3, threading
+from crc32 import crc32
+import porting
+
+class HashCache:
+    """ Provides a persistent cache of CRC values.
+        A file is identified by its device, inode, size and modification time,
+        so a file that changes in any way (even with a preserved mtime) is a
+        miss, while a file that is only renamed or moved is still a hit.
+        The device matters because inode numbers are only unique per device,
+        and a backup reads both the source and destination drives.
+        Only the latest crc of each inode is kept, so the cache never holds
+        more rows than there are inodes on the drives it has seen.
+        The cache is a sqlite database, so it is never loaded into memory.
+    """
+    dbPathname = None
+    db = None
+    pending = 0         # stores not yet committed
+    batch = 1000        # stores per commit
+    lock = None         # one connection is shared by every thread
+
+    def __init__(self, filename="~/PyBackup.cache.db", clean=False):
+        """ filename can be a fully qualified pathname or simple filename.
+            If desired, any pre-existing cache can be removed during initialization.
+        """
+        self.dbPathname = porting.abspath(filename)
+        if clean:
+            self.remove()
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.dbPathname, check_same_thread=False)
+        self.db.execute("PRAGMA auto_vacuum=INCREMENTAL")  # only for a new cache
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS hashes ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, crc TEXT, "
+            "PRIMARY KEY (dev, ino, size, mtime_ns)) WITHOUT ROWID")
+
+    def lookup(self, pn, st=None):
+        """ Return the cached CRC for a file, or None if it is not known """
+        if st is None:
+            st = os.stat(pn)
+        if st.st_ino == 0:  # some file systems have no inode numbers
+            return None
+        with self.lock:
+            row = self.db.execute("SELECT crc FROM hashes "
+                "WHERE dev=? AND ino=? AND size=? AND mtime_ns=?",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)).fetchone()
+        return None if row is None else row[0]
+
+    def store(self, pn, crc, st=None):
+        """ Remember the CRC of a file, forgetting any other CRC of its inode.
+            st should be the result of os.stat from before the file was hashed.
+        """
+        if st is None:
+            st = os.stat(pn)
+        if st.st_ino == 0:
+            return
+        with self.lock:
+            self.db.execute("DELETE FROM hashes WHERE dev=? AND ino=?", (st.st_dev, st.st_ino))
+            self.db.execute("INSERT INTO hashes VALUES (?, ?, ?, ?, ?)",
+                (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns, crc))
+            self.pending += 1
+            if self.pending >= self.batch:
+                self.commit()
+
+    def crc32(self, pn, st=None):
+        """ Return the CRC of a file, hashing it only if it is not cached.
+            st can be a recent os.stat result for the file.
+            Returns a tuple of (crc, hashed).
+        """
+        if st is None:
+            st = os.stat(pn)
+        crc = self.lookup(pn, st)
+        if crc is not None:
+            return crc, False
+        crc = crc32(pn)
+        self.store(pn, crc, st)
+        return crc, True
+
+    def commit(self):
+        """ Save stored CRCs to disk """
+        with self.lock:
+            self.db.commit()
+            self.pending = 0
+
+    def close(self):
+        """ Save stored CRCs and close the cache, returning the space
+            of forgotten CRCs to the file system.
+        """
+        if self.db is not None:
+            with self.lock:
+                self.commit()
+                self.db.execute("PRAGMA incremental_vacuum")
+                self.db.close()
+                self.db = None
+
+    def remove(self):
+        """ Remove any cache previously created using this instance """
+        self.close()
+        for suffix in ['', '-wal', '-shm']:
+            try:
+                os.remove(self.dbPathname + suffix)
+            except:
+                pass # it is not noteworthy that a file to be deleted did not exist
+
+if __name__ == '__main__':
+    """ Test this class """
+    testfile = "HashCache.test.db"
+    datafile = "HashCache.test.dat"
+    cache = HashCache(testfile, clean=True)
+    with open(datafile, 'w') as fh:
+        fh.write("Some data to be hashed")
+    print("first: {}".format(cache.crc32(datafile)))
+    print("again: {}".format(cache.crc32(datafile)))
+
+    # A size change with a preserved mtime must not be a hit
+    st = os.stat(datafile)
+    with open(datafile, 'a') as fh:
+        fh.write(" and then some")
+    os.utime(datafile, ns=(st.st_atime_ns, st.st_mtime_ns))
+    crc, hashed = cache.crc32(datafile)
+    print("{}: size change {}".format("OK" if hashed else "ERROR", crc))
+    rows = cache.db.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+    print("{}: {} row for the file".format("OK" if rows == 1 else "ERROR", rows))
+    cache.close()
+
+    # The cache survives being closed and reopened
+    cache = HashCache(testfile)
+    crc2, hashed = cache.crc32(datafile)
+    print("{}: reopened {}".format("ERROR" if hashed or crc != crc2 else "OK", crc2))
+    cache.remove()
+    os.remove(datafile)
@@ -36,6 +36,8 @@ class JsonFile:
         try:
             with open(self.jsonPathname) as jf:
                 data = json.load(jf)
+            if isinstance(data, str):
+                data = json.loads(data) # written by older versions, encoded twice
             self.report("{} read".format(self.jsonPathname))
             return data
         except:
@@ -45,8 +47,7 @@ class JsonFile:
         """ Write a dictionary to a json file """
         try:
             with open(self.jsonPathname, 'w') as fh:
-                js = json.dumps(data)
-                json.dump(js, fh)
+                json.dump(data, fh)
             self.report("{} written".format(self.jsonPathname))
         except:
             self.report("{} could not be written".format(self.jsonPathname))
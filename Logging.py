@@ -146,6 +146,12 @@ class logging:
         else:
             counters[name] = 1
 
+    def merge(self, counters, deltas):
+        """ Add a dictionary of counters, e.g. from another process, to counters """
+        for name in deltas:
+            counters[name] = counters.get(name, 0) + deltas[name]
+        return counters
+
     def counter(self, count, msg):
         """ Display a counter in a consistent way. """
         if count == 1:
@@ -9,8 +9,9 @@
 # Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 #-------------------------------------------------------------------------------
 
-import glob, re, os, sys
+import atexit, glob, re, os, sys
 from crc32 import crc32
+from HashCache import HashCache
 from EXIF_Dating import GetExifDate, GetFileDate, GetExifDimensions
 from PyBackup import logging, ReadCrcs, recursive_mkdir, display_update
 import porting
@@ -32,6 +33,7 @@ errors = {}
 stats = {szFile:0}
 log = None      # logging class instantiations
 record = None
+cache = None    # remembers crcs across runs (shared with PyBackup)
 
 def help():
     print("""
@@ -81,7 +83,7 @@ def archive(pn, recursive):
     global archive_pictures, picture_exts
     global archive_videos, video_exts
     global months
-    global log, stats, errors, szFile
+    global log, stats, errors, szFile, cache
 
     # Only archive some types of files
     rootp, ext = os.path.splitext(pn)
@@ -120,7 +122,10 @@ def archive(pn, recursive):
 
     # Read the CRCs at the destination.
     # If a duplicate CRC exists then delete the source file and done
-    crc = crc32(pn)
+    if cache is not None:
+        crc, hashed = cache.crc32(pn)
+    else:
+        crc = crc32(pn)
     crcs, last_modified = ReadCrcs(log, folder)
     if fn in crcs:
         if crc == crcs[fn]:
@@ -188,6 +193,8 @@ if __name__ == '__main__':
     # Create a logfile
     log = logging("Photo-Backup.errors.txt")
     record = logging("Photo-Backup.log.txt")    # keep success out of the error log
+    cache = HashCache()
+    atexit.register(cache.close)
 
     # Process the command line arguments
     folder = os.getcwd();   # <path>: use a path other than the current working directory
@@ -10,6 +10,8 @@
 #-------------------------------------------------------------------------------
 
 import glob, re, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 
 from EXIF_Dating import GetExifDate, SetExifDate, GetFileDate
 from Logging import logging, display_update
@@ -19,6 +21,7 @@ szFile = "file"
 stats = {szFile:0}
 errors = {}
 log = None
+pool = None     # -j N: the processes that add dates to several files at once
 
 filespec = '*'              # can be changed by the command prompt
 picture_exts = ['.jpg', '.jpeg',  '.heic', '.png']
@@ -29,12 +32,13 @@ def help():
     Add exif date data to files.
     -r  Recursively process subfolders
     -n  Deduce the date from the filename
-    -m  Deduce the date from the file modification date""")
+    -m  Deduce the date from the file modification date
+    -j N  Date N files at the same time, each in its own process""")
 
 def date_format(mts):
-    """ Create a list of strings from a timestamp: [YYYY, MM, DD, HH, MM, SS] """
-    return [str(mts.tm_year), ("0" + str(mts.tm_mon))[-2:], ("0" + str(mts.tm_mday))[-2:],
-            ("0" + str(mts.tm_hour))[-2:], ("0" + str(mts.tm_min))[-2:], ("0" + str(mts.tm_sec))[-2:]]
+    """ Create a tuple of strings from a timestamp: (YYYY, MM, DD, HH, MM, SS) """
+    return (str(mts.tm_year), ("0" + str(mts.tm_mon))[-2:], ("0" + str(mts.tm_mday))[-2:],
+            ("0" + str(mts.tm_hour))[-2:], ("0" + str(mts.tm_min))[-2:], ("0" + str(mts.tm_sec))[-2:])
 
 def process(pn, how='j'):
     """ Add exif data to one file.
@@ -83,7 +87,7 @@ def process(pn, how='j'):
 
     elif how == 'n':
         # Get a file date either from the filename or the parent folder name
-        # Returns a list of [YYYY, MM, DD, HH, MM, SS], all text string numbers.
+        # Returns a tuple of (YYYY, MM, DD, HH, MM, SS), all text string numbers.
         file_date = true_file_date = GetFileDate(fn)
         if file_date is None:
             file_date = GetFileDate(pn.split('\\')[-2])
@@ -104,6 +108,8 @@ def process(pn, how='j'):
             log.count(stats, "added Exif date", pn)
         else:
             log.count(errors, "failed adding Exif date", pn)
+    except ImportError as e:
+        log.count(errors, str(e), pn)
     except:
         log.count(errors, "SetExifDate exception", pn)
 
@@ -114,14 +120,33 @@ def process(pn, how='j'):
             log.count(stats, "well named and dated picture", pn, silent=True)
             return
 
+def start_worker(logfile):
+    """ Set up a worker process to log like the main process """
+    global log
+    log = logging(logfile, clean=False)
+
+def process_counted(pn, how):
+    """ Process one file in a worker process, returning its counters """
+    global stats, errors
+    stats, errors = {szFile:0}, {}
+    process(pn, how)
+    return stats, errors
+
 def main(pn, recursive, method):
     """ Add date info to files in a folder, possibly recursively """
-    global filespec
+    global filespec, pool
 
     # Process files in a folder with no recursion
-    for fn in glob.glob(glob.escape(pn) + os.sep + filespec):
-        if os.path.isfile(fn):
+    files = [fn for fn in glob.glob(glob.escape(pn) + os.sep + filespec) if os.path.isfile(fn)]
+    if pool is None:
+        for fn in files:
             process(fn, method)
+    else:
+        # The counters of each file are added up here, in the order of the files
+        for file_stats, file_errors in pool.map(process_counted, files, repeat(method), chunksize=4):
+            log.merge(stats, file_stats)
+            log.merge(errors, file_errors)
+        display_update(stats[szFile], szFile)
 
     # Process folders recursively, when requested
     if recursive:
@@ -136,10 +161,17 @@ if __name__ == '__main__':
     pn = os.getcwd()    # <path>: use a path other than the current working directory
     recursive = False   # -r: recursively process subfolders
     method = 'j'
+    workers = 1         # -j N: date N files at the same time
 
-    for arg in sys.argv[1:]:
+    args = iter(sys.argv[1:])
+    for arg in args:
         if arg[0] == '-':
-            if arg[1].lower() == 'r':
+            if arg[1].lower() == 'j':
+                try:
+                    workers = int(arg[2:] or next(args, ''))
+                except ValueError:
+                    help()
+            elif arg[1].lower() == 'r':
                 recursive = True
             elif arg[1].lower() in ['n', 'm']:
                 method = arg[1].lower()
@@ -153,6 +185,11 @@ if __name__ == '__main__':
                     log.error(errors, "folder error", pn)
                     help()
 
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+            initargs=(log.logfile,))
     main(pn, recursive, method)
+    if pool is not None:
+        pool.shutdown()
     log.counters(stats)
     log.counters(errors)
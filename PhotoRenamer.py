@@ -11,6 +11,8 @@
 #-------------------------------------------------------------------------------
 
 import glob, re, os, sys, time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from EXIF_Dating import GetExifDate, SetExifDate, GetFileDate
 from Logging import logging, display_update
 
@@ -18,6 +20,7 @@ szFile = "file"
 stats = {szFile:0}
 errors = {}
 log = None
+pool = None     # -j N: the processes that date several files at once
 
 filespec = '*'              # can be changed by the command prompt
 use_modified_date = False   # -m: reset the date based upon the file date
@@ -32,10 +35,19 @@ def help():
     -s  Strip any existing date found in the current filename
     -f  ignore existing exif data and use the date found in the Filename instead
     -m  use the Modified date if no other date is available
-    -r  Recursively process subfolders""")
+    -r  Recursively process subfolders
+    -j N  Date N files at the same time, each in its own process""")
 
 def rename(pn, strip, reset):
     """ Rename one file """
+    newname = new_name(pn, strip, reset)
+    if newname is not None:
+        rename_file(pn, newname)
+
+def new_name(pn, strip, reset):
+    """ Decide what one file should be named, adding an EXIF date if needed.
+        Returns the new filename, without its folder, or None to leave it.
+    """
     global use_modified_date, picture_exts
     global log, stats, errors, szFile
 
@@ -76,12 +88,12 @@ def rename(pn, strip, reset):
                 if use_modified_date:
                     modt = os.path.getmtime(pn) # create time epoch for date
                     mts = time.localtime(modt)
-                    file_date = [ str(mts.tm_year),
+                    file_date = ( str(mts.tm_year),
                                 ("0"+str(mts.tm_mon))[-2:],
                                 ("0"+str(mts.tm_mday))[-2:],
                                 ("0"+str(mts.tm_hour))[-2:],
                                 ("0"+str(mts.tm_min))[-2:],
-                                ("0"+str(mts.tm_sec))[-2:] ]
+                                ("0"+str(mts.tm_sec))[-2:] )
                 else:
                     log.error(errors, "undated file", pn)
                     return
@@ -96,6 +108,8 @@ def rename(pn, strip, reset):
                         log.count(stats, "added Exif date", pn)
                     else:
                         log.count(errors, "failed adding Exif date", pn)
+                except ImportError as e:
+                    log.count(errors, str(e), pn)
                 except:
                     log.count(errors, "SetExifDate exception", pn)
 
@@ -152,10 +166,16 @@ def rename(pn, strip, reset):
             fn = m.group(2)
             m = re.search("^"+sep+"("+yyyy+mm+dd+")(.*)", fn)
 
-    # Rename the file to match the date
-    # If a matching file exists, add a number to make the new file unique
+    return prefix + fn
+
+def rename_file(pn, newfn):
+    """ Rename a file within its folder.
+        If a matching file exists, add a number to make the new file unique.
+    """
+    global log, stats, errors
+    rootp, fn = os.path.split(pn)
     for i in range(10): # limit of ten duplicates
-        filename, ext = os.path.splitext(prefix+fn)
+        filename, ext = os.path.splitext(newfn)
         if i == 0:
             number = ''
         else:
@@ -175,14 +195,39 @@ def rename(pn, strip, reset):
     if i > 9:
         log.error(errors, "rename limit failure", newname)
 
+def start_worker(logfile, modified):
+    """ Set up a worker process to log and date files like the main process """
+    global log, use_modified_date
+    log = logging(logfile, clean=False)
+    use_modified_date = modified
+
+def new_name_counted(pn, strip, reset):
+    """ Decide a new name in a worker process, returning it and its counters """
+    global stats, errors
+    stats, errors = {szFile:0}, {}
+    newname = new_name(pn, strip, reset)
+    return newname, stats, errors
+
 def main(pn, strip, reset, recursive):
     """ Rename files in a folder, possibly recursively """
-    global filespec
+    global filespec, pool
 
     # Process files in a folder with no recursion
-    for fn in glob.glob(glob.escape(pn) + '\\' + filespec):
-        if os.path.isfile(fn):
+    files = [fn for fn in glob.glob(glob.escape(pn) + '\\' + filespec) if os.path.isfile(fn)]
+    if pool is None:
+        for fn in files:
             rename(fn, strip, reset)
+    else:
+        # Files are dated by the workers, but only renamed here, one at a
+        # time in the order of the files, so numbered duplicates are the
+        # same as without -j.
+        for fn, (newname, file_stats, file_errors) in zip(files,
+                pool.map(new_name_counted, files, repeat(strip), repeat(reset), chunksize=4)):
+            log.merge(stats, file_stats)
+            log.merge(errors, file_errors)
+            if newname is not None:
+                rename_file(fn, newname)
+        display_update(stats[szFile], szFile)
 
     # Process folders recursively, when requested
     if recursive:
@@ -199,10 +244,17 @@ if __name__ == '__main__':
     reset = False       # -f: ignore the EXIF date and use the filename date instead
     recursive = False   # -r: recursively process subfolders
     use_modified_date = False   # -m: reset the date based upon the file date
+    workers = 1         # -j N: date N files at the same time
 
-    for arg in sys.argv[1:]:
+    args = iter(sys.argv[1:])
+    for arg in args:
         if arg[0] in ['-', '/']:
-            if arg[1].lower() == 's':
+            if arg[1].lower() == 'j':
+                try:
+                    workers = int(arg[2:] or next(args, ''))
+                except ValueError:
+                    help()
+            elif arg[1].lower() == 's':
                 strip = True
             elif arg[1].lower() == 'f':
                 reset = True
@@ -225,6 +277,11 @@ if __name__ == '__main__':
     if strip:
         reset = False
 
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=start_worker,
+            initargs=(log.logfile, use_modified_date))
     main(pn, strip, reset, recursive) # rename all files in a folder
+    if pool is not None:
+        pool.shutdown()
     log.counters(stats)
     log.counters(errors)
@@ -9,105 +9,201 @@
 # Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 #-------------------------------------------------------------------------------
 
-import glob, os, re, sys, time, zlib
-from shutil import copyfile
-from crc32 import crc32
+import atexit, os, re, shutil, sys, threading, time, zlib
+from concurrent.futures import ThreadPoolExecutor
+from crc32 import crc32, hash_many
+from HashCache import HashCache
+import DirScan
+from FileCopy import copy_many, copy_methods
+import CrcFile
 from Logging import logging, display_update, timespent
 import porting
 
-crc_filename = "crc.csv"        # the control file found in every folder
+crc_filename = CrcFile.csv_filename  # the control file found in every folder
+crc_format = 'csv'              # --crc-format: write crc.csv or crc.bin files
+control_files = [CrcFile.csv_filename, CrcFile.bin_filename,
+    CrcFile.csv_filename + ".tmp", CrcFile.bin_filename + ".tmp"]
+workers = 1                     # -j: number of files hashed (or copied) at the same time
+reread = False                  # -c: check every copy by reading it back
+copy_method = 'stream'          # --copy-method: see FileCopy.copy_methods
+cache = None                    # remembers crcs across runs, unless -n is used
+renames = True                  # --no-renames: copy moved source files again
+rename_size = 1024 * 1024       # --rename-size: smaller files are copied, never renamed
+mirror = False                  # --mirror: also delete destination files that are not in the source
+dry_run = False                 # --dry-run: only display what --mirror would do
+journal_age = 24 * 60 * 60      # seconds an interrupted backup can be resumed for
 
 szFolder = "folder"
 szFile = "file"
 szHashedFile = "hashed file"
 szCopiedFile = "copied file"
-stats = {szFolder:0, szFile:0, szHashedFile:0, szCopiedFile: 0}
-errors = {}
+szRenamedFile = "renamed file"
+szDeletedFile = "deleted file"
+szDeletedFolder = "deleted folder"
 
+class Counters(threading.local):
+    """ Statistics kept separately by every thread, i.e. by every backup job """
+    def __init__(self):
+        self.reset()
 
-def display_summary(log, operation, start):
+    def reset(self):
+        self.stats = {szFolder:0, szFile:0, szHashedFile:0, szCopiedFile: 0}
+        self.errors = {}
+        self.orphans = {}   # destination files without a source: {size: {crc: [pathnames]}}
+        self.tree = None    # (source, dest) whose orphans are indexed when first needed
+        self.indexed = set()    # destination folders whose orphans are indexed
+        self.near = set()       # destination folders whose neighbours are indexed
+        self.moved = {}     # names renamed away from each destination folder
+        self.done = set()   # source folders finished by an interrupted run
+        self.journal = None # records every source folder as it is finished
+        self.synced = 0     # when the journal was last flushed to disk
+
+counters = Counters()
+
+def display_summary(log, operation, start, stats=None, errors=None):
     """ Display a total operational statistics in a consistent way. """
-    #global folders, found, copied, hashes
-    global stats, errors
+    if stats is None:
+        stats, errors = counters.stats, counters.errors
     log.msg("\n{} complete.".format(operation))
     log.counters(stats)
     log.counters(errors)
     log.msg("Completed in {}".format(timespent(start)))
 
 def ReadCrcs(log, pn):
-    """ Return a dictionary of CRC values for every file in a folder """
-    global crc_filename, errors
-    crcs = {}
-    filename = porting.addpath(pn, crc_filename)
-    try:
-        f = open(filename)
-    except: # open may not find the file
-        return crcs, None
+    """ Return a dictionary of CRC values for every file in a folder.
+        Either crc file format is read, preferring the one selected by crc_format.
+    """
+    global crc_format
+    errors = counters.errors
+    readers = [(CrcFile.csv_filename, CrcFile.read_csv), (CrcFile.bin_filename, CrcFile.read_bin)]
+    if crc_format == 'bin':
+        readers.reverse()
+
+    for fn, reader in readers:
+        filename = porting.addpath(pn, fn)
+        if not os.path.isfile(filename):
+            continue
 
-    try:
         # Every line in a CRC file is 8 hexadecimal characters, a comma
         # and the filename. The filename may be quoted.
-        for line in f:
-            # First match a quoted pathname, if possible
-            m = re.match('([0-9A-F]{8}),"(.*?)"', line)
-            # If that fails, match a pathname with no quotes
-            if m == None:
-                m = re.match('([0-9A-F]{8}),(.*)', line)
-            crc = m.group(1)
-            fn = m.group(2)
-            crcs[fn] = crc
-        f.close()
-        last_modified = os.path.getmtime(filename)
-
-    except:
-        # The file must be corrupted. Delete it and discard all crcs.
-        f.close()
-        crcs = {}
-        last_modified = None
         try:
-            os.remove(filename)
-            log.error(errors, "removed (corrupted) file", filename)
+            crcs = reader(filename)
+            return crcs, os.path.getmtime(filename)
         except:
-            log.error(errors, "could not remove file", filename)
+            # The file must be corrupted. Delete it and discard all crcs.
+            try:
+                os.remove(filename)
+                log.error(errors, "removed (corrupted) file", filename)
+            except:
+                log.error(errors, "could not remove file", filename)
+            return {}, None
 
-    return crcs, last_modified
+    return {}, None
 
-def AddCrc(log, pn, crcs, crc = None):
+def AddCrc(log, pn, crcs, crc = None, st = None):
     """ Add a CRC to a dictionary of CRCs.
         This should only be called for an existing file.
+        st can be a recent os.stat result for the file.
+        With --dry-run, the hash cache is read but not written.
         """
-    global stats, errors, szHhashedFile
+    global szHashedFile, cache, dry_run
+    stats, errors = counters.stats, counters.errors
     rootp, fn = os.path.split(pn)
     try:
         if crc == None:
-            crc = crc32(pn)
-            log.increment(stats, szHashedFile)
+            if cache is not None and dry_run:
+                crc = cache.lookup(pn, st)
+                hashed = crc is None
+                if hashed:
+                    crc = crc32(pn)
+            elif cache is not None:
+                crc, hashed = cache.crc32(pn, st)
+            else:
+                crc, hashed = crc32(pn), True
+            if hashed:
+                log.increment(stats, szHashedFile)
         crcs[fn] = crc
     except: # crc32 must have failed
         if fn in crcs:
             crcs.pop(fn)
         log.error(errors, "crc32 failure", pn)
 
-def WriteCrcs(log, pn, crcs):
-    """ Save a dictionary of CRC values for every file in a folder """
-    global crc_filename, errors
+def WriteCrcs(log, pn, crcs, files=None, original=None):
+    """ Save a dictionary of CRC values for every file in a folder.
+        files can be a dictionary of DirScan entries for the folder;
+        crc.bin records the size and modification time of each file.
+        original can be the dictionary returned by ReadCrcs. Then nothing
+        is written when nothing changed, and crc.csv changes are appended.
+        Given files, every crc was just checked, so an unchanged crc.csv
+        is touched. Files older than it are then not hashed again.
+    """
+    global crc_format
+    errors = counters.errors
+    if crc_format == 'bin':
+        filename = porting.addpath(pn, CrcFile.bin_filename)
+        other = porting.addpath(pn, CrcFile.csv_filename)
+    else:
+        filename = porting.addpath(pn, CrcFile.csv_filename)
+        other = porting.addpath(pn, CrcFile.bin_filename)
+    if original is not None and not os.path.isfile(filename):
+        original = None # the other format was read, so convert it
     try:
-        filename = porting.addpath(pn, crc_filename)
-        f = open(filename, 'w')
-        for fn in sorted(crcs):
-            # Quote the pathname to make it work better in Excel
-            f.write(crcs[fn]+',"'+fn+'"\n')
-        f.close()
+        if crc_format == 'bin':
+            stats = {}
+            for fn in crcs:
+                if files is not None and fn in files:
+                    st = files[fn].st
+                else:
+                    st = os.stat(porting.addpath(pn, fn))
+                stats[fn] = (st.st_size, st.st_mtime_ns)
+            # The recorded sizes and times must be kept up to date too
+            if crcs == original and recorded_stats(filename) == stats:
+                return
+            CrcFile.write_bin(filename, crcs, stats)
+        elif original is not None:
+            if CrcFile.update_csv(filename, crcs, original) == "unchanged":
+                if files is not None:
+                    os.utime(filename)
+                return
+        else:
+            CrcFile.write_csv(filename, crcs)
     except: # the above really should work, or else we have no CRCs
         log.error(errors, "open failure", filename)
+        return
+
+    # Only one crc file format is kept in a folder
+    if os.path.isfile(other):
+        try:
+            os.remove(other)
+        except:
+            log.error(errors, "could not remove file", other)
+
+def recorded_stats(filename):
+    """ Return the (size, mtime_ns) recorded for every file in a crc.bin,
+        or None if it cannot be read.
+    """
+    try:
+        with CrcFile.CrcBin(filename) as cb:
+            return {fn: (size, mtime_ns) for fn, crc, size, mtime_ns in cb.items()}
+    except:
+        return None
+
+def open_bin(folder):
+    """ Open the crc.bin in a folder for lookups, or return None """
+    try:
+        return CrcFile.CrcBin(porting.addpath(folder, CrcFile.bin_filename))
+    except:
+        return None
 
 def verify(log, source, update=False):
     """ check crc values for one folder """
-    global crc_filename
-    global stats, errors, szFolder, szHashedFile, szFile
+    global control_files
+    global szFolder, szHashedFile, szFile, workers, cache
+    stats, errors = counters.stats, counters.errors
 
     # Start by reading CRC files, if they exist
     source_crcs, source_modified = ReadCrcs(log, source)
+    original = dict(source_crcs)
     if source_modified == None:
         log.error(errors, "missing CRC file", source)
         missing = True
@@ -120,62 +216,86 @@ def verify(log, source, update=False):
     display_update(stats[szFile], szFile, True)
     log.increment(stats, szFolder)
 
+    # List the source folder once
+    files, folders = DirScan.scan(source)
+    for fn in control_files:        # ignore the CRC control files
+        files.pop(fn, None)
+
     # Prune out the crc values for any files that no longer exist
     if not missing:
-        rootp, fn = os.path.split(source)
         for fn in dict(source_crcs).keys():
-            pn = porting.addpath(source, fn)
-            if not os.path.exists(pn):
-                log.error(errors, "missing source file", pn)
+            if fn not in files:
+                log.error(errors, "missing source file", porting.addpath(source, fn))
                 source_crcs.pop(fn)
 
-    # Recursively search the source folder
-    for pn in glob.glob(porting.addpath(glob.escape(source), '*')):
-        rootp, fn = os.path.split(pn)
+    # Collect the files that need to be hashed
+    # Without a hash cache, a crc.bin tells which files are unchanged
+    recorded = open_bin(source) if update and cache is None else None
+    hashlist = []
+    for fn, entry in files.items():
+        # For every other file in the source folder
         display_update(stats[szFile], szFile)
-        if os.path.isfile(pn):
-            if fn != crc_filename:  # ignore the CRC control file
-                # For every other file in the source folder
-                log.increment(stats, szFile)
-                rootp, fn = os.path.split(pn)
-                if update and fn in source_crcs \
-                    and source_modified != None \
-                    and os.path.getmtime(pn) <= source_modified:
-                    continue;   # -u: skip old files
-                print("{}: hashing".format(log.nickname(pn)))
-                display_update(stats[szFile], szFile)
-                try:
-                    crc = crc32(pn)
-                except: # crc32 may not find the file
-                    log.error(errors, "crc32 failure", pn)
+        log.increment(stats, szFile)
+        if update and fn in source_crcs:
+            if cache is not None:
+                # -u: skip files with a remembered crc
+                if cache.lookup(entry.path, entry.st) == source_crcs[fn]:
+                    continue;
+            elif recorded is not None:
+                # -u: skip files with the recorded crc, size and time
+                if recorded.lookup(fn) == (source_crcs[fn], entry.size, entry.st.st_mtime_ns):
                     continue;
+            elif source_modified != None \
+                and entry.mtime <= source_modified:
+                continue;   # -u: skip old files
+        hashlist.append((entry.path, entry.st))
+    if recorded is not None:
+        recorded.close()
 
-                log.increment(stats, szHashedFile)
-                if not missing:
-                    if fn not in source_crcs:
-                        log.count(stats, "new source file", pn)
-                    elif source_crcs[fn] != crc:
-                        log.error(errors, "modified source file", pn)
-                AddCrc(log, pn, source_crcs, crc)
+    # Hash the files, several at a time when -j is used
+    # -v always hashes every file, but remembers the results for next time
+    stat_results = dict(hashlist)
+    for pn, crc in hash_many([pn for pn, st in hashlist], workers):
+        rootp, fn = os.path.split(pn)
+        print("{}: hashed".format(log.nickname(pn)))
+        display_update(stats[szFile], szFile)
+        if crc is None: # crc32 may not find the file
+            log.error(errors, "crc32 failure", pn)
+            continue;
+
+        log.increment(stats, szHashedFile)
+        if cache is not None:
+            cache.store(pn, crc, stat_results[pn])
+        if not missing:
+            if fn not in source_crcs:
+                log.count(stats, "new source file", pn)
+            elif source_crcs[fn] != crc:
+                log.error(errors, "modified source file", pn)
+        AddCrc(log, pn, source_crcs, crc)
 
-        elif os.path.isdir(pn):
-            # For every subfolder
-            verify(log, pn, update)
+    # Recursively search every subfolder
+    for entry in folders:
+        verify(log, entry.path, update)
 
     # Finish off by replacing CRC files
-    WriteCrcs(log, source, source_crcs)
+    WriteCrcs(log, source, source_crcs, files, original)
 
-def backup(log, src, dst):
-    """ backup one source file """
-    global copied, stats, errors, szCopiedFile
-    rootp, srcfn = os.path.split(src)
-    try:
-        copyfile(src, dst)
-    except:
+def backup(log, src, dst, crc):
+    """ Record the result of backing up one source file.
+        crc is the crc of the copied data, or None if the copy failed.
+    """
+    global szCopiedFile, cache
+    stats, errors = counters.stats, counters.errors
+    if crc is None:
         log.error(errors, "copyfile failure", src)
         log.msg('\t"{}": not replaced'.format(dst))
         return 0
     log.count(stats, szCopiedFile, dst)
+    if cache is not None:
+        try:
+            cache.store(dst, crc)
+        except: # not being able to remember a crc is not a failure
+            pass
     return 1
 
 def recursive_mkdir(pn):
@@ -186,11 +306,184 @@ def recursive_mkdir(pn):
             recursive_mkdir(rootp)
         os.mkdir(pn)
 
+def index_orphans(log, folder):
+    """ Index the files in one destination folder whose source file no
+        longer exists, by size and crc. When a source file has been moved,
+        main can then rename its old copy instead of copying it again.
+        Only files listed in a crc file are indexed, and only they are stat'ed.
+        A file modified after its crc file was written is not indexed,
+        since its crc cannot be trusted.
+    """
+    source, dest = counters.tree
+    if folder in counters.indexed \
+        or not (folder == dest or folder.startswith(porting.addpath(dest, ''))):
+        return
+    counters.indexed.add(folder)
+    try:
+        source_names = set(os.listdir(source + folder[len(dest):]))
+    except OSError:
+        source_names = set()
+    dest_crcs, dest_modified = ReadCrcs(log, folder)
+    for fn, crc in dest_crcs.items():
+        if fn not in source_names:
+            pn = porting.addpath(folder, fn)
+            try:
+                st = os.stat(pn)
+            except OSError:
+                continue
+            if st.st_mtime <= dest_modified:
+                counters.orphans.setdefault(st.st_size, {}).setdefault(crc, []).append(pn)
+
+def find_orphans(log, dest, size):
+    """ Return the orphans that could be renamed to a file of this size
+        in a destination folder, as a dictionary of pathnames by crc.
+        Orphans are only looked for near the folder: in it, its subfolders,
+        its parent and the parent's other subfolders. Each folder is
+        indexed the first time it is needed, so a backup never walks the
+        whole destination tree, and one with nothing to copy reads nothing.
+        Files smaller than rename_size are cheap to copy, and never renamed.
+    """
+    global rename_size
+    if counters.tree is None or size < rename_size:
+        return {}
+    if dest not in counters.near:
+        counters.near.add(dest)
+        folders = [dest] if dest == counters.tree[1] else [dest, os.path.dirname(dest)]
+        for folder in folders:
+            index_orphans(log, folder)
+            for entry in DirScan.subfolders(folder):
+                index_orphans(log, entry.path)
+    return counters.orphans.get(size, {})
+
+def rename_orphan(log, crc, size, dest_pn):
+    """ Rename a destination file with the same contents to dest_pn.
+        With a hash cache, the crc of the orphan is checked first.
+        Returns True when a file was renamed.
+    """
+    global cache
+    stats = counters.stats
+    pathnames = find_orphans(log, os.path.dirname(dest_pn), size).get(crc)
+    while pathnames:
+        pn = pathnames.pop(0)
+        try:
+            if cache is not None and cache.crc32(pn)[0] != crc:
+                continue
+        except OSError:
+            continue
+        try:
+            os.replace(pn, dest_pn)
+        except OSError:
+            continue
+        rootp, fn = os.path.split(pn)
+        counters.moved.setdefault(rootp, set()).add(fn)
+        write_journal("moved", pn)
+        log.count(stats, szRenamedFile, dest_pn)
+        log.msg('\t"{}": renamed from'.format(pn), silent=True)
+        return True
+    return False
+
+def remove_moved_crcs(log):
+    """ Remove the crcs of renamed files from folders already backed up """
+    for folder, names in counters.moved.items():
+        crcs, modified = ReadCrcs(log, folder)
+        original = dict(crcs)
+        for fn in names:
+            crcs.pop(fn, None)
+        WriteCrcs(log, folder, crcs, None, original)
+
+def journal_filename(source, dest):
+    """ Every backup job has its own journal, named after its folders """
+    job = (source + '\n' + dest).encode('utf-8', 'surrogateescape')
+    return porting.abspath("~/PyBackup.{:08X}.journal".format(zlib.crc32(job)))
+
+def read_journal(filename):
+    """ Read the journal of an interrupted backup.
+        Returns (started, done, moved) or None if there is no valid journal:
+            started is the time the interrupted backup started.
+            done is the set of source folders it finished.
+            moved is the names it renamed away from each destination folder.
+    """
+    try:
+        with open(filename, encoding='utf-8', errors='surrogateescape') as f:
+            lines = [line[:-1] for line in f if line.endswith('\n')]
+        kind, tab, started = lines[0].partition('\t')
+        started = float(started)
+    except (OSError, IndexError, ValueError):
+        return None
+    if kind != "started":
+        return None
+    done, moved = set(), {}
+    for line in lines[1:]:
+        kind, tab, pn = line.partition('\t')
+        if kind == "done":
+            done.add(pn)
+        elif kind == "moved":
+            rootp, fn = os.path.split(pn)
+            moved.setdefault(rootp, set()).add(fn)
+    return started, done, moved
+
+def write_journal(kind, pn):
+    """ Record a finished source folder ("done") or a renamed file ("moved").
+        The journal is flushed after every line and synced to disk
+        every few seconds.
+    """
+    journal = counters.journal
+    if journal is not None:
+        journal.write(kind + '\t' + pn + '\n')
+        journal.flush()
+        if time.time() - counters.synced > 5:
+            os.fsync(journal.fileno())
+            counters.synced = time.time()
+
+def backup_tree(log, source, dest):
+    """ Backup one source folder and all of its subfolders.
+        Progress is journaled, so a backup that is interrupted resumes
+        where it stopped, without listing or hashing finished folders again.
+        A journal older than journal_age is ignored, and the backup starts over.
+    """
+    global renames, mirror, journal_age
+    if mirror:
+        mirror_tree(log, source, dest)
+        return
+    counters.orphans, counters.moved, counters.tree = {}, {}, None
+    counters.indexed, counters.near = set(), set()
+    journal = journal_filename(source, dest)
+    resumed = read_journal(journal)
+    if resumed is not None and time.time() - resumed[0] > journal_age:
+        log.msg("Ignoring the journal of a backup of {} started {}".format(source, time.ctime(resumed[0])))
+        resumed = None
+    if resumed is not None:
+        started, counters.done, counters.moved = resumed
+        log.msg("Resuming the backup of {} started {}: {:,} folders were already backed up".format(
+            source, time.ctime(started), len(counters.done)))
+        counters.journal = open(journal, 'a', encoding='utf-8', errors='surrogateescape')
+    else:
+        counters.done = set()
+        counters.journal = open(journal, 'w', encoding='utf-8', errors='surrogateescape')
+        write_journal("started", str(time.time()))
+    try:
+        if renames and os.path.isdir(dest):
+            counters.tree = (source, dest)
+        main(log, source, dest)
+        remove_moved_crcs(log)
+    finally:
+        counters.journal.close()
+        counters.journal = None
+    os.remove(journal)  # only once the whole tree is done
+
 ##############################################################################
 def main(log, source, dest):
     """ backup one source folder """
-    global crc_filename
-    global stats, errors, szFolder, szCopiedFile, szFile
+    global control_files
+    global szFolder, szCopiedFile, szFile, cache, workers, reread, copy_method
+    stats, errors = counters.stats, counters.errors
+
+    # A folder finished before an interruption is not looked at again
+    if source in counters.done:
+        log.increment(stats, "resumed folder")
+        for entry in DirScan.subfolders(source):
+            main(log, entry.path, porting.addpath(dest, entry.name))
+        return
 
     # Start by reading CRC files, if they exist
     print("B: {}: {} folders, {} copied, {} errors".format( \
@@ -200,80 +493,395 @@ def main(log, source, dest):
     source_crcs, source_modified = ReadCrcs(log, source)
     recursive_mkdir(dest)
     dest_crcs, dest_modified = ReadCrcs(log, dest)
+    source_original, dest_original = dict(source_crcs), dict(dest_crcs)
+
+    # List both folders once
+    source_files, source_folders = DirScan.scan(source)
+    for fn in control_files:
+        source_files.pop(fn, None)
+    dest_files, dest_folders = DirScan.scan(dest)
+    for fn in control_files:
+        dest_files.pop(fn, None)
 
     # Prune out the crc values for any files that no longer exist
     if source_modified != None:
         for fn in dict(source_crcs).keys():
-            pn = porting.addpath(source, fn)
-            if not os.path.exists(pn):
-                log.error(errors, "missing source file", pn)
+            if fn not in source_files:
+                log.error(errors, "missing source file", porting.addpath(source, fn))
                 source_crcs.pop(fn)
 
     # Prune out the crc values for any files that no longer exist
+    # Files renamed into another folder are not missing
+    for fn in counters.moved.get(dest, []):
+        dest_crcs.pop(fn, None)
     if dest_modified != None:
         for fn in dict(dest_crcs).keys():
-            pn = porting.addpath(dest, fn)
-            if not os.path.exists(pn):
-                log.error(errors, "missing destination file", pn)
+            if fn not in dest_files:
+                log.error(errors, "missing destination file", porting.addpath(dest, fn))
                 dest_crcs.pop(fn)
 
-    # Recursively search the source folder
-    for pn in glob.glob(porting.addpath(glob.escape(source), '*')):
-        rootp, fn = os.path.split(pn)
+    # For every file in the source folder
+    copies = []
+    for fn, entry in source_files.items():
+        pn = entry.path
+        dest_pn = porting.addpath(dest, fn)
         display_update(stats[szFile], szFile)
-        if os.path.isfile(pn):
-            if fn == crc_filename:
-                pass
-            else:
-                # For every file in the source folder
-                dest_pn = porting.addpath(dest, fn)
-                log.increment(stats, szFile)
-
-                # When source_modified is None, source_crcs is empty
-                # Update the source CRC if it is unknown or the file has changed
-                if not fn in source_crcs or os.path.getmtime(pn) > source_modified:
-                    log.increment(stats, "new source crc")  # Not really an error
-                    AddCrc(log, pn, source_crcs)
-
-                # Update the destination CRC for existing destination files
-                # if the CRC is unknown or the file has changed
-                if os.path.exists(dest_pn):
-                    if fn not in dest_crcs:
-                        if dest_modified != None:
-                            log.error(errors, "new destination file", dest_pn)
-                        AddCrc(log, dest_pn, dest_crcs)
-                    elif os.path.getmtime(dest_pn) > dest_modified:
-                        log.error(errors, "modified destination file", dest_pn)
-                        AddCrc(log, dest_pn, dest_crcs)
-
-                # Forget destination crc files if the file no longer exists
-                elif fn in dest_crcs:
-                    log.error(errors, "missing destination file", dest_pn)
-                    dest_crcs.pop(fn)
-
-                # Backup new or modified source files
-                if fn in source_crcs:   # do we have a CRC?
-                    # backup files with no known crc or a different crc
-                    if fn not in dest_crcs or source_crcs[fn] != dest_crcs[fn]:
-                        if backup(log, pn, dest_pn):
-                            AddCrc(log, dest_pn, dest_crcs)  # replace the crc
-                        else:
-                            # Don't keep a CRC if the backup fails
-                            if fn in dest_crcs:
-                                log.error(errors, "removed crc", dest_pn)
-                                dest_crcs.pop(fn)
+        log.increment(stats, szFile)
+
+        # A new file with no destination is hashed while it is copied
+        # Other copy methods need the source crc first, and so does
+        # a file that may have been moved (an orphan has the same size)
+        if copy_method == 'stream' \
+            and fn not in source_crcs and fn not in dest_files \
+            and not find_orphans(log, dest, entry.size) \
+            and (cache is None or cache.lookup(pn, entry.st) is None):
+            copies.append((pn, dest_pn, None))
+            continue
+
+        # When source_modified is None, source_crcs is empty
+        # Update the source CRC if it is unknown or the file has changed
+        # The hash cache notices changes without trusting the crc file date
+        if cache is not None or not fn in source_crcs \
+            or entry.mtime > source_modified:
+            crc = source_crcs.get(fn)
+            AddCrc(log, pn, source_crcs, st=entry.st)
+            if crc != source_crcs.get(fn):
+                log.increment(stats, "new source crc")  # Not really an error
+
+        # Update the destination CRC for existing destination files
+        # if the CRC is unknown or the file has changed
+        if fn in dest_files:
+            dest_st = dest_files[fn].st
+            if fn not in dest_crcs:
+                if dest_modified != None:
+                    log.error(errors, "new destination file", dest_pn)
+                AddCrc(log, dest_pn, dest_crcs, st=dest_st)
+            elif cache is not None:
+                crc = dest_crcs[fn]
+                AddCrc(log, dest_pn, dest_crcs, st=dest_st)
+                if crc != dest_crcs.get(fn):
+                    log.error(errors, "modified destination file", dest_pn)
+            elif dest_st.st_mtime > dest_modified:
+                log.error(errors, "modified destination file", dest_pn)
+                AddCrc(log, dest_pn, dest_crcs, st=dest_st)
+
+        # Backup new or modified source files
+        if fn in source_crcs:   # do we have a CRC?
+            # backup files with no known crc or a different crc
+            if fn not in dest_crcs or source_crcs[fn] != dest_crcs[fn]:
+                if rename_orphan(log, source_crcs[fn], entry.size, dest_pn):
+                    dest_crcs[fn] = source_crcs[fn]
+                    dest_files.pop(fn, None)
                 else:
-                    # The only explaination for a missing source CRC
-                    # is that it could not be computed
-                    pass
+                    copies.append((pn, dest_pn, source_crcs[fn]))
+        else:
+            # The only explaination for a missing source CRC
+            # is that it could not be computed
+            pass
 
-        elif os.path.isdir(pn):
-            # For every subfolder
-            main(log, pn, porting.addpath(dest, fn))
+    # Copy files, several at a time when -j is used
+    # The crc of the data written replaces the destination crc
+    for pn, dest_pn, crc in copy_many(copies, workers, copy_method, reread):
+        rootp, fn = os.path.split(pn)
+        dest_files.pop(fn, None)    # the old stat results are out of date
+        if backup(log, pn, dest_pn, crc):
+            dest_crcs[fn] = crc
+            if fn not in source_crcs:
+                log.increment(stats, "new source crc")  # Not really an error
+                source_crcs[fn] = crc
+                if cache is not None:
+                    cache.store(pn, crc, source_files[fn].st)
+        else:
+            # Don't keep a CRC if the backup fails
+            if fn in dest_crcs:
+                log.error(errors, "removed crc", dest_pn)
+                dest_crcs.pop(fn)
 
-    # Finish off by replacing CRC files
-    WriteCrcs(log, source, source_crcs)
-    WriteCrcs(log, dest, dest_crcs)
+    # Replace the CRC files before any subfolder, so they are saved
+    # even if a subfolder fails, and then record the folder as finished
+    for fn in counters.moved.get(dest, []):
+        if fn not in source_files:
+            dest_crcs.pop(fn, None)
+    WriteCrcs(log, source, source_crcs, source_files, source_original)
+    WriteCrcs(log, dest, dest_crcs, dest_files, dest_original)
+    write_journal("done", source)
+
+    # For every subfolder
+    for entry in source_folders:
+        main(log, entry.path, porting.addpath(dest, entry.name))
+
+##############################################################################
+# Mirror mode
+#
+# A mirror is planned in full before the destination is changed.
+# The plan is a dictionary of lists:
+#   copy    [source, destination, crc or None, size]
+#   rename  (old destination, source, destination, crc, size)
+#   delete  (destination, crc or None, size)
+#           the crc is None unless the crc file is newer than the file,
+#           so a file changed since the last backup is never renamed
+#   rmdir   destination folders that are not in the source
+#   folders the crcs of every folder by destination, written at the end:
+#           [source, source_crcs, source_files, source_original,
+#            dest_crcs, dest_files, dest_original]
+
+def plan_folder(log, source, dest, plan):
+    """ Plan the mirror of one source folder and its subfolders.
+        Like main, crcs are brought up to date, but nothing is copied.
+    """
+    global control_files, cache, copy_method
+    stats, errors = counters.stats, counters.errors
+    display_update(stats[szFile], szFile)
+    log.increment(stats, szFolder)
+    source_crcs, source_modified = ReadCrcs(log, source)
+    dest_crcs, dest_modified = ReadCrcs(log, dest)
+    source_original, dest_original = dict(source_crcs), dict(dest_crcs)
+    source_files, source_folders = DirScan.scan(source)
+    dest_files, dest_folders = DirScan.scan(dest)
+    for fn in control_files:
+        source_files.pop(fn, None)
+        dest_files.pop(fn, None)
+
+    # Prune out the crc values for any files that no longer exist
+    for fn in list(source_crcs):
+        if fn not in source_files:
+            log.error(errors, "missing source file", porting.addpath(source, fn))
+            source_crcs.pop(fn)
+    for fn in list(dest_crcs):
+        if fn not in dest_files:
+            log.error(errors, "missing destination file", porting.addpath(dest, fn))
+            dest_crcs.pop(fn)
+
+    for fn, entry in source_files.items():
+        dest_pn = porting.addpath(dest, fn)
+        log.increment(stats, szFile)
+
+        # A new file is only hashed later, if it might have been moved
+        # Other copy methods need the source crc first, as in main
+        if copy_method == 'stream' \
+            and fn not in dest_files and fn not in source_crcs \
+            and (cache is None or cache.lookup(entry.path, entry.st) is None):
+            plan['copy'].append([entry.path, dest_pn, None, entry.size])
+            continue
+
+        if cache is not None or fn not in source_crcs or entry.mtime > source_modified:
+            crc = source_crcs.get(fn)
+            AddCrc(log, entry.path, source_crcs, st=entry.st)
+            if crc != source_crcs.get(fn):
+                log.increment(stats, "new source crc")  # Not really an error
+        if fn in dest_files and (cache is not None or fn not in dest_crcs \
+            or dest_files[fn].mtime > dest_modified):
+            AddCrc(log, dest_pn, dest_crcs, st=dest_files[fn].st)
+        if fn in source_crcs and (fn not in dest_crcs or source_crcs[fn] != dest_crcs[fn]):
+            plan['copy'].append([entry.path, dest_pn, source_crcs[fn], entry.size])
+
+    # Everything else in the destination goes
+    for fn, entry in dest_files.items():
+        if fn not in source_files:
+            crc = dest_crcs.pop(fn, None)
+            if dest_modified is None or entry.mtime > dest_modified:
+                crc = None  # like index_orphans, a modified file is not renamed
+            plan['delete'].append((entry.path, crc, entry.size))
+    names = set(entry.name for entry in source_folders)
+    for entry in dest_folders:
+        if entry.name not in names:
+            plan_removal(log, entry.path, plan)
+
+    plan['folders'][dest] = [source, source_crcs, source_files, source_original,
+        dest_crcs, dest_files, dest_original]
+    for entry in source_folders:
+        plan_folder(log, entry.path, porting.addpath(dest, entry.name), plan)
+
+def plan_removal(log, folder, plan):
+    """ Plan the removal of a destination folder that is not in the source.
+        Its files are listed one by one, so they can be renamed instead.
+    """
+    global control_files, workers
+    for pn, (files, folders) in DirScan.walk(folder, workers):
+        crcs, modified = ReadCrcs(log, pn)
+        for fn, entry in files.items():
+            if fn not in control_files:
+                crc = crcs.get(fn)
+                if modified is None or entry.mtime > modified:
+                    crc = None
+                plan['delete'].append((entry.path, crc, entry.size))
+    plan['rmdir'].append(folder)
+
+def plan_renames(log, plan):
+    """ Turn copies of files that are about to be deleted into renames """
+    deletes = {}
+    for pn, crc, size in plan['delete']:
+        if crc is not None:
+            deletes.setdefault(size, {}).setdefault(crc, []).append(pn)
+
+    copies = []
+    renamed = set()
+    for item in plan['copy']:
+        src, dst, crc, size = item
+        if size in deletes and crc is None:
+            # Hash a new file now, only because its size matches
+            source_crcs = plan['folders'][os.path.dirname(dst)][1]
+            AddCrc(log, src, source_crcs)
+            crc = item[2] = source_crcs.get(os.path.basename(src))
+        pathnames = deletes.get(size, {}).get(crc)
+        if pathnames:
+            renamed.add(pathnames[0])
+            plan['rename'].append((pathnames.pop(0), src, dst, crc, size))
+        else:
+            copies.append(item)
+    plan['copy'] = copies
+    plan['delete'] = [item for item in plan['delete'] if item[0] not in renamed]
+
+def display_plan(log, plan):
+    """ Display what a mirror will do, with byte totals """
+    for pn, src, dst, crc, size in plan['rename']:
+        log.msg('rename "{}" "{}"'.format(pn, dst), silent=True)
+    for pn, crc, size in plan['delete']:
+        log.msg('delete "{}"'.format(pn), silent=True)
+    for folder in plan['rmdir']:
+        log.msg('rmdir "{}"'.format(folder), silent=True)
+    for src, dst, crc, size in plan['copy']:
+        log.msg('copy "{}" "{}"'.format(src, dst), silent=True)
+    log.msg("Mirror plan:")
+    log.msg("{:12,} files to copy, {:,} bytes".format(
+        len(plan['copy']), sum(item[3] for item in plan['copy'])))
+    log.msg("{:12,} files to rename, {:,} bytes not copied".format(
+        len(plan['rename']), sum(item[4] for item in plan['rename'])))
+    log.msg("{:12,} files to delete, {:,} bytes".format(
+        len(plan['delete']), sum(item[2] for item in plan['delete'])))
+    log.msg("{:12,} folders to delete".format(len(plan['rmdir'])))
+
+def execute_plan(log, plan):
+    """ Rename, delete and then copy, one destination folder at a time.
+        The folders with the most to copy go first, and so do the
+        largest files within a folder, to keep the copies sequential.
+    """
+    global cache, workers, copy_method, reread
+    stats, errors = counters.stats, counters.errors
+    folders = plan['folders']
+    copies = plan['copy']
+
+    for pn, src, dst, crc, size in plan['rename']:
+        rootp, fn = os.path.split(dst)
+        try:
+            recursive_mkdir(rootp)
+            os.replace(pn, dst)
+        except OSError:
+            copies.append([src, dst, crc, size])
+            continue
+        log.count(stats, szRenamedFile, dst)
+        folders[rootp][4][fn] = crc
+        folders[rootp][5].pop(fn, None)
+
+    for pn, crc, size in plan['delete']:
+        try:
+            os.remove(pn)
+            log.count(stats, szDeletedFile, pn, silent=True)
+        except OSError:
+            log.error(errors, "could not remove file", pn)
+    for folder in plan['rmdir']:
+        try:
+            shutil.rmtree(folder)
+            log.count(stats, szDeletedFolder, folder)
+        except OSError:
+            log.error(errors, "could not remove folder", folder)
+
+    batches = {}
+    for item in copies:
+        batches.setdefault(os.path.dirname(item[1]), []).append(item)
+    ordered = []
+    for folder in sorted(batches, key=lambda folder: -sum(item[3] for item in batches[folder])):
+        recursive_mkdir(folder)
+        ordered += sorted(batches[folder], key=lambda item: -item[3])
+    for src, dst, crc in copy_many([item[:3] for item in ordered], workers, copy_method, reread):
+        rootp, fn = os.path.split(dst)
+        source, source_crcs, source_files, source_original, dest_crcs, dest_files, dest_original = folders[rootp]
+        dest_files.pop(fn, None)    # the old stat results are out of date
+        if backup(log, src, dst, crc):
+            dest_crcs[fn] = crc
+            if fn not in source_crcs:
+                log.increment(stats, "new source crc")  # Not really an error
+                source_crcs[fn] = crc
+                if cache is not None:
+                    cache.store(src, crc, source_files[fn].st)
+        elif fn in dest_crcs:
+            log.error(errors, "removed crc", dst)
+            dest_crcs.pop(fn)
+
+    for dest, (source, source_crcs, source_files, source_original,
+        dest_crcs, dest_files, dest_original) in folders.items():
+        recursive_mkdir(dest)
+        WriteCrcs(log, source, source_crcs, source_files, source_original)
+        WriteCrcs(log, dest, dest_crcs, dest_files, dest_original)
+
+def mirror_tree(log, source, dest):
+    """ Make a destination folder (and its subfolders) match the source.
+        With --dry-run, the plan is only displayed.
+    """
+    global dry_run
+    plan = {'copy': [], 'rename': [], 'delete': [], 'rmdir': [], 'folders': {}}
+    plan_folder(log, source, dest, plan)
+    plan_renames(log, plan)
+    display_plan(log, plan)
+    if not dry_run:
+        execute_plan(log, plan)
+
+##############################################################################
+def device(pn):
+    """ Return the device holding a pathname, or its nearest existing parent """
+    while True:
+        try:
+            return os.stat(pn).st_dev
+        except OSError:
+            parent = os.path.dirname(pn)
+            if parent == pn:
+                return None
+            pn = parent
+
+def schedule(jobs):
+    """ Group backup jobs so that jobs sharing any source or destination
+        device run one after another, while groups can run at the same time.
+        jobs is a list of (source, dest) tuples.
+        Returns a list of groups, each a list of jobs in their original order.
+    """
+    groups = []     # [devices, jobs]
+    for job in jobs:
+        devices = {device(job[0]), device(job[1])}
+        shared = [group for group in groups if group[0] & devices]
+        merged = [devices, []]
+        for group in shared:
+            merged[0] |= group[0]
+            merged[1] += group[1]
+            groups.remove(group)
+        merged[1].append(job)
+        merged[1].sort(key=jobs.index)
+        groups.append(merged)
+    return [group[1] for group in groups]
+
+def run_jobs(log, jobs):
+    """ Backup one group of jobs, one job at a time.
+        Returns a list of (job, stats, errors), one for each job.
+    """
+    results = []
+    for source, dest in jobs:
+        counters.reset()
+        backup_tree(log, source, dest)
+        results.append(((source, dest), counters.stats, counters.errors))
+    return results
+
+def run_all_jobs(log, jobs):
+    """ Backup all jobs, running jobs on independent devices concurrently.
+        Returns a list of (job, stats, errors) in the original job order.
+    """
+    groups = schedule(jobs)
+    if len(groups) > 1:
+        log.msg("Running {} groups of backups on independent devices".format(len(groups)))
+    with ThreadPoolExecutor(max_workers=max(len(groups), 1)) as pool:
+        results = []
+        for group_results in pool.map(lambda group: run_jobs(log, group), groups):
+            results += group_results
+    results.sort(key=lambda result: jobs.index(result[0]))
+    return results
 
 def help():
     """ display command line help and exit """
@@ -281,7 +889,16 @@ def help():
             "\n1) no parameters\t-- backup folders using ~/backup.ini"
             "\n2) souce dest\t\t-- backup one folder"
             "\n3) -u [folders]\t\t-- update recorded crcs in a list of folders"
-            "\n4) -v [folders]\t\t-- validate current crcs in a list of folders")
+            "\n4) -v [folders]\t\t-- validate current crcs in a list of folders"
+            "\n\n-j N can be added to any of the above to hash (or copy) N files at the same time"
+            "\n-n can be added to any of the above to not use (or update) ~/PyBackup.cache.db"
+            "\n-c can be added to a backup to check every copy by reading it back")
+    print("--copy-method={} selects how a backup copies files".format(" | ".join(copy_methods)))
+    print("--crc-format=csv | bin selects which crc control files are written")
+    print("--no-renames copies moved files again, rather than renaming their old copies in the destination")
+    print("--rename-size=N copies files smaller than N bytes rather than renaming them (default {:,})".format(rename_size))
+    print("--mirror also deletes destination files and folders that are not in the source")
+    print("--dry-run displays what --mirror would copy, rename and delete, without changing anything,\n\teven the hash cache")
     print("\nValidation details:")
     print("A crc file is counted as corrupted when an exception occurs while reading or writing a control file.")
     print("A crc is counted as missing once for each control file or once for each data file.")
@@ -312,6 +929,52 @@ if __name__ == '__main__':
         cmdline += ' ' + arg
     log.msg("{}".format(os.getcwd() + "> " + cmdline), silent=True)
 
+    # Options that can be combined with any other use of PyBackup
+    # PyBackup -j N ...
+    # PyBackup -n ...
+    # PyBackup -c ...
+    # PyBackup --copy-method=method ...
+    # PyBackup --crc-format=csv|bin ...
+    # PyBackup --no-renames ...
+    # PyBackup --rename-size=N ...
+    # PyBackup --mirror ...
+    # PyBackup --dry-run ...
+    use_cache = True
+    argv = sys.argv[:1]
+    args = iter(sys.argv[1:])
+    for arg in args:
+        if arg[:2] in ['-j', '-J']:
+            workers = int(arg[2:] or next(args, '1'))
+        elif arg in ['-n', '-N']:
+            use_cache = False
+        elif arg in ['-c', '-C']:
+            reread = True
+        elif arg == '--no-renames':
+            renames = False
+        elif arg.startswith('--rename-size'):
+            try:
+                rename_size = int(arg[len('--rename-size='):] or next(args, ''))
+            except ValueError:
+                help()
+        elif arg == '--mirror':
+            mirror = True
+        elif arg == '--dry-run':
+            mirror = dry_run = True
+        elif arg.startswith('--crc-format'):
+            crc_format = arg[len('--crc-format='):] or next(args, '')
+            if crc_format not in ['csv', 'bin']:
+                help()
+        elif arg.startswith('--copy-method'):
+            copy_method = arg[len('--copy-method='):] or next(args, '')
+            if copy_method not in copy_methods:
+                help()
+        else:
+            argv.append(arg)
+    sys.argv = argv
+    if use_cache:
+        cache = HashCache()
+        atexit.register(cache.close)
+
     # First look for command line switches
     # PyBackup -?
     # PyBackup -u pathname
@@ -338,7 +1001,7 @@ if __name__ == '__main__':
         """ A source and destination was provided. Backup one folder """
         srcp = porting.abspath(sys.argv[1])
         destp = porting.abspath(sys.argv[2])
-        main(log, srcp, destp)
+        backup_tree(log, srcp, destp)
         display_summary(log, "Backup", start)
         exit()
 
@@ -364,13 +1027,24 @@ if __name__ == '__main__':
         exit()
 
     # Allow exceptions for the rest
+    jobs = []
     for line in f:
         if not line[0] in "#\n\r":
             # Match two quoted names separated by a comma
             m = re.match('"(.*?)","(.*?)"', line)
             if m != None:
-                main(log, porting.abspath(m.group(1)), porting.abspath(m.group(2)))
+                jobs.append((porting.abspath(m.group(1)), porting.abspath(m.group(2))))
             else:
-                log.error(errors, "inifile syntax error", line[:-1])
+                log.error(counters.errors, "inifile syntax error", line[:-1])
     f.close()
-    display_summary(log, "Backup", start)
+
+    # Jobs on independent devices run at the same time
+    # Each job keeps its own statistics, which are merged at the end
+    stats, errors = counters.stats, counters.errors
+    for job, job_stats, job_errors in run_all_jobs(log, jobs):
+        log.msg('\n"{}" -> "{}"'.format(job[0], job[1]))
+        log.counters(job_stats)
+        log.counters(job_errors)
+        log.merge(stats, job_stats)
+        log.merge(errors, job_errors)
+    display_summary(log, "Backup", start, stats, errors)
@@ -17,7 +17,7 @@ szScanned = "scanned folder"
 szRemoved = "removed folder"
 stats = {szScanned:0, szRemoved:0}
 errors = {}
-crc_filename = "crc.csv"
+control_files = ["crc.csv", "crc.bin"]    # the crc files PyBackup writes
 
 def help(log):
     print("""
@@ -35,7 +35,7 @@ def RemoveEmpty(log, cmd, folder):
         Returns False if all is well.
         Returns True if a command script is required to remove folders.
     """
-    global crc_filename, stats, errors, szScanned, szRemoved
+    global control_files, stats, errors, szScanned, szRemoved
 
     display_update(stats[szScanned], szScanned)
     useScript = False
@@ -53,14 +53,15 @@ def RemoveEmpty(log, cmd, folder):
                 return useScript
         elif os.path.isfile(pn):
             rootp, fn = os.path.split(pn)
-            if fn.lower() != crc_filename:
+            if fn.lower() not in control_files:
                 return useScript
         else:
             log.error(errors, "exception", fn)
 
-    if os.path.exists(folder+'\\'+crc_filename):
-        os.remove(folder+'\\'+crc_filename)
-        log.count(stats, "removed crc file")
+    for fn in control_files:
+        if os.path.exists(folder+'\\'+fn):
+            os.remove(folder+'\\'+fn)
+            log.count(stats, "removed crc file")
     try:
         os.rmdir(folder)
     except:
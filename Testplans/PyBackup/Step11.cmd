@@ -0,0 +1,37 @@
+@echo off
+@Rem Mirror a folder in which a file was moved, after its old copy in the
+@Rem mirror was overwritten. The old copy must not be renamed into place.
+SetLocal
+
+@Rem The next lines delete files and folders created when this step is performed.
+cd %temp%
+if exist pybackup.step11.log.txt del pybackup.step11.log.txt
+if not exist pybackup md pybackup
+cd %temp%\pybackup
+if exist step11 rd step11 /s /q
+
+@Rem Create a source folder and mirror it
+md step11\source\a
+echo Step11: the original data>step11\source\a\moved.dat
+%2 pybackup --mirror step11\source step11\mirror
+del %temp%\pybackup.log.txt
+
+@Rem Wait so the changes below are newer than the crc files
+ping -n 3 127.0.0.1 >nul
+
+@Rem Move the source file, and overwrite its old copy with data of the same size
+md step11\source\b
+move step11\source\a\moved.dat step11\source\b\moved.dat >nul
+echo Step11: the changed data!>step11\mirror\a\moved.dat
+
+@echo on
+%2 pybackup --mirror step11\source step11\mirror
+@echo off
+ren %temp%\pybackup.log.txt pybackup.step11.log.txt
+
+Rem The mirror must hold the source data, copied rather than renamed
+fc /b step11\source\b\moved.dat step11\mirror\b\moved.dat >>%temp%\pybackup.step11.log.txt
+type step11\mirror\b\crc.csv >>%temp%\pybackup.step11.log.txt
+endlocal
+fc %temp%\pybackup.step11.log.txt results\*.*
+@exit /b
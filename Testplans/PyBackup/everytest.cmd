@@ -1,4 +1,4 @@
 @Echo off
 Rem Run the complete test suite, expecting no errors.
-for %%s in (1 2 3 4 5 6 7 8 9 10) do call step%%s @Rem
+for %%s in (1 2 3 4 5 6 7 8 9 10 11) do call step%%s @Rem
 call cleanup
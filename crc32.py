@@ -9,32 +9,113 @@
 # Licence:     GNU GENERAL PUBLIC LICENSE Version 3, 29 June 2007
 #-------------------------------------------------------------------------------
 
-import glob, os, sys, zlib
+import glob, mmap, os, sys, zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 filespec = '*'  # By default all files are processed
+workers = 1     # -j: number of files hashed at the same time
 
-def crc32(pn):
+# crc32() always reads files with readinto, into one 64 KiB buffer,
+# whatever their size. mmap is only used when a caller asks for it:
+# it is a little faster for large files, but a file truncated while it is
+# mapped kills the process (SIGBUS). See Benchmarks.py io for the numbers.
+blocksize = 64 * 1024               # bytes hashed per zlib.crc32 call
+
+def crc32(pn, method=None, size=None):
     """ Compute the CRC32 for a single file.
         Returns a hexadecimal string.
+
+        method selects how the file is read:
+            'read'      read() a new bytes object for every block
+            'readinto'  readinto() one reused buffer
+            'mmap'      memory map the whole file, falling back to readinto
+                        when it cannot be mapped (e.g. on some network shares)
+        By default readinto is used.
+        size is the block size, which defaults to the global blocksize.
     """
+    global blocksize
+    if size is None:
+        size = blocksize
     crc = 0
     with open(pn, 'rb') as fh:
-        while True:
-            rdata = fh.read(65536)
-            if not rdata:
-                break
-            crc = zlib.crc32(rdata, crc)
+        mm = None
+        if method == 'mmap':
+            try:
+                mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):   # e.g. empty files cannot be mapped
+                method = 'readinto'
+        elif method is None:
+            method = 'readinto'
+
+        if mm is not None:
+            with mm:
+                if hasattr(mm, 'madvise'):
+                    mm.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mm) as view:
+                    for offset in range(0, len(view), size):
+                        crc = zlib.crc32(view[offset:offset+size], crc)
+
+        elif method == 'readinto':
+            buffer = bytearray(size)
+            with memoryview(buffer) as view:
+                while True:
+                    count = fh.readinto(buffer)
+                    if not count:
+                        break
+                    crc = zlib.crc32(view[:count], crc)
+
+        else:
+            while True:
+                rdata = fh.read(size)
+                if not rdata:
+                    break
+                crc = zlib.crc32(rdata, crc)
     return "%08X" % (crc & 0xFFFFFFFF)
 
+def _crc32_or_none(pn):
+    """ Compute the CRC32 for a single file, returning None on failure """
+    try:
+        return crc32(pn)
+    except:
+        return None
+
+def hash_many(pathnames, workers=1):
+    """ Compute the CRC32 for many files, several files at a time.
+        Yields (pathname, crc) tuples in the same order as pathnames.
+        crc is None when a file could not be read.
+
+        zlib releases the GIL while it hashes large buffers, so a pool of
+        threads keeps several disks (or one fast disk) busy at once.
+        Only a few files per worker are ever in flight, so pathnames
+        can be a generator over a very large tree.
+    """
+    if workers <= 1:
+        for pn in pathnames:
+            yield pn, _crc32_or_none(pn)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for pn in pathnames:
+            pending.append((pn, pool.submit(_crc32_or_none, pn)))
+            if len(pending) >= workers * 4:
+                pn, future = pending.popleft()
+                yield pn, future.result()
+        while pending:
+            pn, future = pending.popleft()
+            yield pn, future.result()
+
 def crc32pn(pn, recursive):
     """ Compute the CRC for one file or all files in one folder """
-    global filespec
+    global filespec, workers
 
     if os.path.isdir(pn):
         # Use filespec to find files and folders within a folder
-        for fn in glob.glob(glob.escape(pn) + os.sep + filespec):
-            if os.path.isfile(fn):
-                crc32pn(fn, recursive)  # process files
+        files = [fn for fn in glob.glob(glob.escape(pn) + os.sep + filespec) \
+                    if os.path.isfile(fn)]
+        for fn, crc in hash_many(files, workers):
+            print_crc(fn, crc)
 
         # Perform recursion
         if recursive:
@@ -43,8 +124,15 @@ def crc32pn(pn, recursive):
                     crc32pn(fn, recursive)
     else:
         # Compute the CRC for one file
-        rootp, fn = os.path.split(pn)
-        print('0x{},"{}","{}"'.format(crc32(pn), fn, pn))
+        print_crc(pn, _crc32_or_none(pn))
+
+def print_crc(pn, crc):
+    """ Print one line of CSV style output """
+    rootp, fn = os.path.split(pn)
+    if crc is None:
+        print('ERROR,"{}","{}"'.format(fn, pn))
+    else:
+        print('0x{},"{}","{}"'.format(crc, fn, pn))
 
 def main(pn, recursive):
     """ Compute the CRC32 for a set of files and folders """
@@ -56,18 +144,22 @@ def main(pn, recursive):
         crc32pn(pn, recursive) # use a modified filespec
 
 if __name__ == '__main__':
-    """ CRC32 [-r] [{pathname}]
+    """ CRC32 [-r] [-j N] [{pathname}]
         -r  Recursively process subfolders
+        -j  Hash N files at the same time
     """
     recursive = False
     count = 0
 
     # Print a header for the CSV file style output
     print("CRC,Filename,Pathname")
-    for arg in sys.argv[1:]:
+    args = iter(sys.argv[1:])
+    for arg in args:
         if arg[0] == '-':
             if arg[1].lower() == 'r':
                 recursive = True
+            elif arg[1].lower() == 'j':
+                workers = int(arg[2:] or next(args, '1'))
         else:
             main(os.path.abspath(os.path.expanduser(arg)), recursive)
             count += 1